@@ -1,22 +1,70 @@
 import sys
 import os
+import argparse
+import asyncio
 
 # プロジェクトのルートディレクトリへのパスを追加
 current_dir = os.path.dirname(os.path.abspath(__file__))
 project_root = os.path.dirname(os.path.dirname(current_dir))
 sys.path.append(project_root)
 from gamma.lib.fetch_event import EventFetcher
+from gamma.lib.event_crawler import crawl_event_pages
 from gamma.lib.create_json import create_json_file
+from gamma.lib.snapshot import SnapshotWriter, find_snapshot
+from gamma.lib.event_sync import (fetch_updated_events, merge_snapshot, load_watermark,
+                                  save_watermark, newer_timestamp, parse_timestamp)
 from tqdm import tqdm
 
+LIMIT = 100
+MAX_EVENTS = 20000
+
+parser = argparse.ArgumentParser(description='Fetch all events from the Gamma API')
+parser.add_argument('--concurrency', type=int, default=8,
+                    help='Number of page requests kept in flight (1 = sequential)')
+parser.add_argument('--format', choices=['ndjson', 'json'], default='ndjson',
+                    help='ndjson streams one event per line; json writes the legacy indented array')
+parser.add_argument('--compress', action='store_true', help='gzip the NDJSON snapshot')
+parser.add_argument('--incremental', action='store_true',
+                    help='Only fetch events updated since the last successful crawl and merge them into the snapshot')
+args = parser.parse_args()
+
 # EventFetcherのインスタンスを作成
 fetcher = EventFetcher("https://gamma-api.polymarket.com")
 
-# すべてのイベントを格納するリスト
-all_events = []
+# 差分同期: 前回のウォーターマーク以降に更新されたイベントのみ取得
+if args.incremental:
+    watermark = load_watermark()
+    try:
+        snapshot_path = find_snapshot()
+    except FileNotFoundError:
+        snapshot_path = None
+    if watermark is None or snapshot_path is None:
+        print("No previous crawl found. Falling back to a full crawl.")
+    elif parse_timestamp(watermark.get('updatedAt')) is None:
+        # ウォーターマークが壊れている場合は取りこぼしを防ぐため全件取得する
+        print(f"Invalid watermark {watermark.get('updatedAt')!r}. Falling back to a full crawl.")
+    else:
+        print(f"Fetching events updated since {watermark['updatedAt']}")
+        updated_events = asyncio.run(fetch_updated_events(fetcher, watermark['updatedAt'], limit=LIMIT,
+                                                          max_events=MAX_EVENTS,
+                                                          concurrency=args.concurrency))
+        result = merge_snapshot(snapshot_path, updated_events,
+                                compress=args.compress or snapshot_path.endswith('.gz'))
+        latest = watermark['updatedAt']
+        for event in updated_events:
+            latest = newer_timestamp(latest, event.get('updatedAt'))
+        save_watermark(latest, result['path'])
+        print("Summary of incremental sync:")
+        print(f"Updated events: {result['updated']}")
+        print(f"New events: {result['added']}")
+        print(f"Total events in snapshot: {result['total']}")
+        print(f"Watermark: {latest}")
+        sys.exit(0)
 
-LIMIT = 100
-MAX_EVENTS = 20000
+# json形式の場合のみ全イベントをメモリに保持する
+all_events = []
+latest_updated_at = None
+writer = SnapshotWriter("events", compress=args.compress) if args.format == 'ndjson' else None
 
 class RangeFormatter:
     def __init__(self, n):
@@ -30,24 +78,54 @@ class RangeFormatter:
     def __format__(self, format_spec):
         return self.format_range()
 
-range_formatter = RangeFormatter(0)
-for i in tqdm(range(0, MAX_EVENTS, LIMIT), 
-             desc="Fetching events", 
-             bar_format='{desc}: {percentage:3.0f}%|{bar}| {n_fmt}/{total_fmt} [eta {remaining}] ({postfix})',
-             postfix=range_formatter):
-    range_formatter.n = i // LIMIT
-    events = fetcher.fetch_events(offset=i, limit=LIMIT)
-    if events == []:
-        print("No more events to fetch")
-        break
-    all_events.extend(events)
-
-# 結合したイベントデータをJSONファイルとして保存
-print("Summary of fetched events:")
-print(f"Total events fetched: {len(all_events)}")
-print(f"Oldest event fetched: {all_events[0]['createdAt']}")
-print(f"Newest event fetched: {all_events[-1]['createdAt']}")
-# marketsキーの存在チェックを追加
-total_markets = sum([len(event.get('markets', [])) for event in all_events])
-print(f"Total markets fetched: {total_markets}")
-create_json_file(all_events, "events")
\ No newline at end of file
+async def fetch_all():
+    global latest_updated_at
+    range_formatter = RangeFormatter(0)
+    pbar = tqdm(total=MAX_EVENTS // LIMIT,
+                desc="Fetching events",
+                bar_format='{desc}: {percentage:3.0f}%|{bar}| {n_fmt}/{total_fmt} [eta {remaining}] ({postfix})',
+                postfix=range_formatter)
+    async for offset, events in crawl_event_pages(fetcher, limit=LIMIT, max_events=MAX_EVENTS,
+                                                  concurrency=args.concurrency):
+        range_formatter.n = offset // LIMIT
+        for event in events:
+            latest_updated_at = newer_timestamp(latest_updated_at, event.get('updatedAt'))
+        if writer is not None:
+            writer.write_events(events)
+        else:
+            all_events.extend(events)
+        pbar.update(1)
+    pbar.close()
+    print("No more events to fetch")
+
+try:
+    asyncio.run(fetch_all())
+except BaseException:
+    if writer is not None:
+        writer.abort()
+    raise
+
+if writer is not None:
+    if writer.event_count == 0:
+        writer.abort()
+        print("Error: No events fetched. Snapshot was not created.")
+        sys.exit(1)
+    writer.close()
+    if latest_updated_at is not None:
+        save_watermark(latest_updated_at, writer.path)
+    print("Summary of fetched events:")
+    print(f"Total events fetched: {writer.event_count}")
+    print(f"Oldest event fetched: {writer.first_created_at}")
+    print(f"Newest event fetched: {writer.last_created_at}")
+    print(f"Total markets fetched: {writer.market_count}")
+    print(f"NDJSON snapshot successfully created: {writer.path}")
+else:
+    # 結合したイベントデータをJSONファイルとして保存
+    print("Summary of fetched events:")
+    print(f"Total events fetched: {len(all_events)}")
+    print(f"Oldest event fetched: {all_events[0]['createdAt']}")
+    print(f"Newest event fetched: {all_events[-1]['createdAt']}")
+    # marketsキーの存在チェックを追加
+    total_markets = sum([len(event.get('markets', [])) for event in all_events])
+    print(f"Total markets fetched: {total_markets}")
+    create_json_file(all_events, "events")
@@ -0,0 +1,155 @@
+import time
+import threading
+from typing import Callable, Dict, List, Optional
+
+# Postgresのstatement_timeoutによるキャンセル
+STATEMENT_TIMEOUT_CODE = "57014"
+# 最後にタイムアウトしたサイズに対する上限の比率
+CEILING_RATIO = 0.9
+
+
+def is_statement_timeout(error: Exception) -> bool:
+    """True if a write failed because the statement was canceled by statement_timeout."""
+    if getattr(error, "code", None) == STATEMENT_TIMEOUT_CODE:
+        return True
+    message = str(error).lower()
+    return STATEMENT_TIMEOUT_CODE in message or "statement timeout" in message
+
+
+class PartialWriteError(Exception):
+    """
+    Raised by AdaptiveBatchSizer.write when a batch fails after earlier batches were committed.
+
+    Args:
+        rows: Rows that were not written (the failed batch and everything after it)
+        error: The original exception
+    """
+
+    def __init__(self, rows: List[dict], error: Exception):
+        super().__init__(str(error))
+        self.rows = rows
+        self.error = error
+
+
+class AdaptiveBatchSizer:
+    """
+    Per-table write batch size tuned from observed latency and statement timeouts.
+
+    Batches that finish under `target_latency` grow the size additively;
+    slower batches shrink it in proportion to how far they overshot, and a
+    statement timeout halves it. A batch that timed out is split in two and
+    each half is written again, down to `min_size` rows. The size of the last
+    batch that timed out is remembered per table, and growth stops at
+    CEILING_RATIO of it.
+
+    Args:
+        initial_size: Starting batch size of every table
+        min_size: Smallest batch size (a timeout at this size is raised)
+        max_size: Largest batch size
+        target_latency: Seconds a single write should take
+        increase_step: Rows added after each write under the target
+        sizes: Starting batch size per table, overriding initial_size
+    """
+
+    def __init__(self,
+                 initial_size: int = 10000,
+                 min_size: int = 100,
+                 max_size: int = 50000,
+                 target_latency: float = 2.0,
+                 increase_step: int = 1000,
+                 sizes: Dict[str, int] = None):
+        self.initial_size = initial_size
+        self.min_size = min_size
+        self.max_size = max_size
+        self.target_latency = target_latency
+        self.increase_step = increase_step
+        self._sizes: Dict[str, int] = dict(sizes or {})
+        # テーブルごとに最後にタイムアウトしたバッチサイズ
+        self._ceilings: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def size(self, table: str) -> int:
+        with self._lock:
+            return self._sizes.get(table, self.initial_size)
+
+    def _set(self, table: str, size: float):
+        self._sizes[table] = int(min(max(size, self.min_size), self.max_size))
+
+    def observe(self, table: str, rows: int, seconds: float):
+        """Adjusts the batch size of a table after a successful write."""
+        with self._lock:
+            size = self._sizes.get(table, self.initial_size)
+            if seconds <= self.target_latency:
+                # 現在のサイズ未満の端数バッチでは増やさない
+                if rows >= size:
+                    grown = size + self.increase_step
+                    ceiling = self._ceilings.get(table)
+                    if ceiling is not None:
+                        # タイムアウトしたサイズの9割までに留める
+                        grown = min(grown, ceiling * CEILING_RATIO)
+                    self._set(table, max(grown, size))
+            else:
+                self._set(table, size * self.target_latency / seconds)
+
+    def on_timeout(self, table: str, rows: int):
+        """Halves the batch size of a table after a statement timeout and caps its growth below `rows`."""
+        with self._lock:
+            size = self._sizes.get(table, self.initial_size)
+            self._ceilings[table] = rows
+            self._set(table, min(size, rows) // 2)
+
+    def write(self, table: str, rows: List[dict], write_fn: Callable[[str, List[dict]], None],
+              on_written: Optional[Callable[[str, List[dict]], None]] = None):
+        """
+        Writes rows in batches of the current size, splitting batches that time out.
+
+        Args:
+            table: Table name
+            rows: Rows to write
+            write_fn: Called as write_fn(table, batch); raises on failure
+            on_written: Called as on_written(table, batch) after each batch is committed
+
+        Raises:
+            PartialWriteError: A batch failed after earlier batches were committed; carries the unwritten rows.
+                If nothing was committed, the original exception is raised
+        """
+        written = 0
+
+        def committed(batch):
+            nonlocal written
+            written += len(batch)
+            if on_written is not None:
+                on_written(table, batch)
+
+        start = 0
+        try:
+            while start < len(rows):
+                batch = rows[start:start + self.size(table)]
+                self._write_batch(table, batch, write_fn, committed)
+                start += len(batch)
+        except Exception as e:
+            if written == 0:
+                raise
+            # 書き込み済みの行は再送しない
+            raise PartialWriteError(rows[written:], e) from e
+
+    def _write_batch(self, table: str, batch: List[dict], write_fn: Callable[[str, List[dict]], None],
+                     committed: Callable[[List[dict]], None]):
+        started = time.monotonic()
+        try:
+            write_fn(table, batch)
+        except Exception as e:
+            if not is_statement_timeout(e) or len(batch) <= self.min_size:
+                raise
+            self.on_timeout(table, len(batch))
+            # 半分ずつ再送する (それでもタイムアウトすればさらに分割)
+            half = len(batch) // 2
+            self._write_batch(table, batch[:half], write_fn, committed)
+            self._write_batch(table, batch[half:], write_fn, committed)
+            return
+        self.observe(table, len(batch), time.monotonic() - started)
+        committed(batch)
+
+    def sizes(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self._sizes)
@@ -0,0 +1,177 @@
+import json
+import time
+import logging
+import threading
+from typing import Callable, Dict, List, Optional, Union
+
+# 子テーブル -> 親テーブル (外部キーの参照先)
+TABLE_PARENTS = {
+    "events": [],
+    "tags": ["events"],
+    "markets": ["events"],
+    "prices": ["markets"],
+    "token_prices": ["markets"],
+}
+
+# バイト数の見積もりでJSONに変換する1回あたりの行数 (全行は変換しない)
+SIZE_SAMPLE_ROWS = 8
+
+
+class BatchWriter:
+    """
+    Collects rows across events per table and writes them in batches.
+
+    A table is flushed when its buffer reaches `max_rows` rows or
+    `max_bytes` bytes (JSON size, estimated from a few sampled rows per
+    call and the running average row size of the table, so rows are not
+    serialized twice), or when its oldest row has waited
+    `max_delay` seconds. Before a batch of a child table is written, every
+    parent table (TABLE_PARENTS) is flushed and all parent batches taken
+    before it have finished, so rows never arrive before the rows they
+    reference.
+
+    Args:
+        flush_fn: Called as flush_fn(table, rows); raises on failure
+        max_rows: Rows per batch, either for all tables or per table
+        max_bytes: Approximate JSON bytes per batch
+        max_delay: Seconds a row may wait in the buffer (None = no timer)
+        parents: Parent tables of each table
+        on_error: Called as on_error(table, rows, exception) when flush_fn fails
+    """
+
+    def __init__(self,
+                 flush_fn: Callable[[str, List[dict]], None],
+                 max_rows: Union[int, Dict[str, int]] = 1000,
+                 max_bytes: int = 8 * 1024 * 1024,
+                 max_delay: Optional[float] = 5.0,
+                 parents: Dict[str, List[str]] = TABLE_PARENTS,
+                 on_error: Optional[Callable[[str, List[dict], Exception], None]] = None):
+        self.flush_fn = flush_fn
+        self.max_rows = max_rows
+        self.max_bytes = max_bytes
+        self.max_delay = max_delay
+        self.parents = parents
+        self.on_error = on_error
+
+        self._buffers: Dict[str, List[dict]] = {}
+        self._buffer_bytes: Dict[str, int] = {}
+        # テーブルごとの1行あたりの平均JSONバイト数と、その算出に使った行数
+        self._row_bytes: Dict[str, float] = {}
+        self._sampled_rows: Dict[str, int] = {}
+        self._first_added: Dict[str, float] = {}
+        # 送信済みバッチの通し番号と、送信中のバッチ番号
+        self._taken_seq: Dict[str, int] = {}
+        self._in_flight: Dict[str, set] = {}
+        self._lock = threading.Lock()
+        self._batch_done = threading.Condition(self._lock)
+
+        self._closed = threading.Event()
+        self._timer = None
+        if max_delay is not None:
+            self._timer = threading.Thread(target=self._timer_loop, name="batch-writer-timer", daemon=True)
+            self._timer.start()
+
+    def _max_rows(self, table: str) -> int:
+        if isinstance(self.max_rows, dict):
+            return self.max_rows.get(table, 1000)
+        return self.max_rows
+
+    def add(self, table: str, row: dict):
+        self.add_many(table, [row])
+
+    def add_many(self, table: str, rows: List[dict]):
+        if not rows:
+            return
+        step = max(len(rows) // SIZE_SAMPLE_ROWS, 1)
+        sample = rows[::step][:SIZE_SAMPLE_ROWS]
+        sample_bytes = sum(len(json.dumps(row, ensure_ascii=False, default=str)) for row in sample)
+        with self._lock:
+            # 標本を含めたこれまでの平均から、追加した行全体のバイト数を見積もる
+            sampled = self._sampled_rows.get(table, 0)
+            average = (self._row_bytes.get(table, 0.0) * sampled + sample_bytes) / (sampled + len(sample))
+            self._row_bytes[table] = average
+            self._sampled_rows[table] = sampled + len(sample)
+            size = int(average * len(rows))
+            buffer = self._buffers.setdefault(table, [])
+            buffer.extend(rows)
+            self._buffer_bytes[table] = self._buffer_bytes.get(table, 0) + size
+            self._first_added.setdefault(table, time.monotonic())
+            full = len(buffer) >= self._max_rows(table) or self._buffer_bytes[table] >= self.max_bytes
+        if full:
+            self.flush(table)
+
+    def _take(self, table: str):
+        with self._lock:
+            rows = self._buffers.pop(table, [])
+            self._buffer_bytes.pop(table, None)
+            self._first_added.pop(table, None)
+            if not rows:
+                return None, rows
+            seq = self._taken_seq.get(table, 0) + 1
+            self._taken_seq[table] = seq
+            self._in_flight.setdefault(table, set()).add(seq)
+            return seq, rows
+
+    def _wait_for_parents(self, table: str):
+        # 現時点までに確保された親バッチが全て書き込まれるまで待つ
+        with self._batch_done:
+            targets = {parent: self._taken_seq.get(parent, 0) for parent in self.parents.get(table, [])}
+            while any(seq <= target
+                      for parent, target in targets.items()
+                      for seq in self._in_flight.get(parent, ())):
+                self._batch_done.wait()
+
+    def flush(self, table: Optional[str] = None):
+        """
+        Writes the buffered rows of a table (all tables if None), parents first.
+        """
+        if table is None:
+            for name in list(self.parents) + [t for t in list(self._buffers) if t not in self.parents]:
+                self.flush(name)
+            return
+
+        # 先に子の行を確保してから親を書き込む。逆順だと確保までの間に
+        # 追加された子の行が、まだバッファにある親より先に送られてしまう
+        seq, rows = self._take(table)
+        if seq is None:
+            return
+        try:
+            for parent in self.parents.get(table, []):
+                self.flush(parent)
+            self._wait_for_parents(table)
+            self.flush_fn(table, rows)
+        except Exception as e:
+            if self.on_error is None:
+                raise
+            self.on_error(table, rows, e)
+        finally:
+            with self._batch_done:
+                self._in_flight[table].discard(seq)
+                self._batch_done.notify_all()
+
+    def _timer_loop(self):
+        interval = max(self.max_delay / 2, 0.1)
+        while not self._closed.wait(interval):
+            now = time.monotonic()
+            with self._lock:
+                expired = [table for table, added in self._first_added.items() if now - added >= self.max_delay]
+            for table in expired:
+                try:
+                    self.flush(table)
+                except Exception:
+                    # on_error未指定の場合でもタイマーは止めない
+                    logging.getLogger(__name__).exception(f"Error flushing {table}")
+
+    def close(self):
+        """Stops the timer and writes every remaining row."""
+        self._closed.set()
+        if self._timer is not None:
+            self._timer.join()
+        self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
@@ -0,0 +1,214 @@
+import os
+import sqlite3
+import threading
+from typing import Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS committed (
+    kind TEXT NOT NULL,
+    key TEXT NOT NULL,
+    PRIMARY KEY (kind, key)
+);
+CREATE TABLE IF NOT EXISTS price_ranges (
+    market_id TEXT NOT NULL,
+    start_ts INTEGER NOT NULL,
+    end_ts INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS price_ranges_market ON price_ranges (market_id);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+"""
+
+
+class CheckpointJournal:
+    """
+    Durable record of what a loader run has committed, backed by SQLite.
+
+    Records committed event ids, markets whose row and price history have
+    been fully committed ("market_done"), and the timestamp range of every
+    committed price batch. A restarted loader consults the journal to skip
+    finished work and to drop price rows that are already in the database.
+
+    Args:
+        path: SQLite file of the journal
+        on_settled: Called as on_settled(market_id) once every queued row of a
+            market declared with expect_market has been committed
+    """
+
+    def __init__(self, path: str, on_settled: Optional[Callable[[str], None]] = None):
+        self.path = path
+        self.on_settled = on_settled
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(SCHEMA)
+        self._lock = threading.Lock()
+
+        self._done: Dict[str, Set[str]] = {}
+        for kind, key in self._conn.execute("SELECT kind, key FROM committed"):
+            self._done.setdefault(kind, set()).add(key)
+        self._price_ranges: Dict[str, List[Tuple[int, int]]] = {}
+        for market_id, start_ts, end_ts in self._conn.execute("SELECT market_id, start_ts, end_ts FROM price_ranges"):
+            self._price_ranges.setdefault(market_id, []).append((start_ts, end_ts))
+
+        # マーケットごとの未コミット行数 (markets行 + prices行)
+        self._pending: Dict[str, int] = {}
+        # expect_market済みのマーケット -> 完了扱いにするか
+        self._expected: Dict[str, bool] = {}
+
+    def mark(self, kind: str, keys: Iterable):
+        """Records keys of a kind (e.g. "events") as committed."""
+        keys = [str(key) for key in keys]
+        if not keys:
+            return
+        with self._lock:
+            self._conn.executemany("INSERT OR IGNORE INTO committed (kind, key) VALUES (?, ?)",
+                                   [(kind, key) for key in keys])
+            self._conn.commit()
+            self._done.setdefault(kind, set()).update(keys)
+
+    def is_done(self, kind: str, key) -> bool:
+        with self._lock:
+            return str(key) in self._done.get(kind, ())
+
+    def done_count(self, kind: str) -> int:
+        with self._lock:
+            return len(self._done.get(kind, ()))
+
+    def record_prices(self, rows: List[dict]):
+        """Records the timestamp range of a committed price batch per market."""
+        ranges = {}
+        for row in rows:
+            market_id = str(row["market_id"])
+            ts = row["timestamp"]
+            lo, hi = ranges.get(market_id, (ts, ts))
+            ranges[market_id] = (min(lo, ts), max(hi, ts))
+        if not ranges:
+            return
+        with self._lock:
+            self._conn.executemany("INSERT INTO price_ranges (market_id, start_ts, end_ts) VALUES (?, ?, ?)",
+                                   [(market_id, lo, hi) for market_id, (lo, hi) in ranges.items()])
+            self._conn.commit()
+            for market_id, span in ranges.items():
+                self._price_ranges.setdefault(market_id, []).append(span)
+
+    def filter_prices(self, rows: List[dict]) -> List[dict]:
+        """Drops price rows that fall inside a committed batch range of their market."""
+        with self._lock:
+            if not self._price_ranges:
+                return rows
+            result = []
+            for row in rows:
+                spans = self._price_ranges.get(str(row["market_id"]))
+                if spans and any(lo <= row["timestamp"] <= hi for lo, hi in spans):
+                    continue
+                result.append(row)
+            return result
+
+    def start_run(self, run_key: str) -> bool:
+        """
+        Binds the journal to the input of a run (e.g. a snapshot path and its mtime).
+
+        If the journal was written for a different input, it is reset first,
+        so progress is only resumed over the same input.
+
+        Returns:
+            True if progress of an unfinished run over the same input is kept
+        """
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM meta WHERE key = 'run'").fetchone()
+        if row is not None and row[0] == run_key:
+            return True
+        self.reset()
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('run', ?)", (run_key,))
+            self._conn.commit()
+        return False
+
+    def finish_run(self):
+        """
+        Clears the journal after a run that completed without failures, so the
+        next run starts over (and refreshes events and open markets).
+        """
+        self.reset()
+        with self._lock:
+            self._conn.execute("DELETE FROM meta WHERE key = 'run'")
+            self._conn.commit()
+
+    def expect_market(self, market_id, rows: int, done: bool = True):
+        """
+        Declares how many rows (market row + prices/token_prices rows) of a market were queued.
+
+        Once that many rows have been committed via on_committed, regardless
+        of which arrives first, on_settled is called and, if `done`, the
+        market is marked "market_done".
+
+        Args:
+            market_id: Market ID
+            rows: Number of queued rows
+            done: Mark the market "market_done" when settled. Only pass True for
+                closed markets whose price history was fetched successfully; open
+                markets keep receiving prices and must not be skipped on a resumed run
+        """
+        market_id = str(market_id)
+        with self._lock:
+            self._pending[market_id] = self._pending.get(market_id, 0) + rows
+            self._expected[market_id] = done
+            finished = self._pending[market_id] == 0
+        if finished:
+            self._finish_market(market_id)
+
+    def on_committed(self, table: str, rows: List[dict]):
+        """Feeds a successfully written batch into the journal."""
+        if table == "events":
+            self.mark("events", (row["id"] for row in rows))
+            return
+        if table in ("prices", "token_prices"):
+            # 価格範囲はpricesのみ記録する (token_pricesの重複はKnownKeysで除く)
+            if table == "prices":
+                self.record_prices(rows)
+            counts = {}
+            for row in rows:
+                counts[str(row["market_id"])] = counts.get(str(row["market_id"]), 0) + 1
+        elif table == "markets":
+            counts = {str(row["id"]): 1 for row in rows}
+        else:
+            return
+
+        finished = []
+        with self._lock:
+            for market_id, count in counts.items():
+                self._pending[market_id] = self._pending.get(market_id, 0) - count
+                if market_id in self._expected and self._pending[market_id] == 0:
+                    finished.append(market_id)
+        for market_id in finished:
+            self._finish_market(market_id)
+
+    def _finish_market(self, market_id: str):
+        with self._lock:
+            self._pending.pop(market_id, None)
+            done = self._expected.pop(market_id, False)
+        if done:
+            self.mark("market_done", [market_id])
+        if self.on_settled is not None:
+            self.on_settled(market_id)
+
+    def reset(self):
+        """Forgets everything recorded so far."""
+        with self._lock:
+            self._conn.execute("DELETE FROM committed")
+            self._conn.execute("DELETE FROM price_ranges")
+            self._conn.commit()
+            self._done.clear()
+            self._price_ranges.clear()
+            self._pending.clear()
+            self._expected.clear()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,203 @@
+import os
+import json
+import time
+import zlib
+import sqlite3
+import threading
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+from gamma.lib.batch_writer import TABLE_PARENTS
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS dead_letters (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    table_name TEXT NOT NULL,
+    row_count INTEGER NOT NULL,
+    payload BLOB NOT NULL,
+    error TEXT,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    created_at REAL NOT NULL,
+    last_attempt_at REAL
+);
+CREATE INDEX IF NOT EXISTS dead_letters_table ON dead_letters (table_name, id);
+"""
+
+
+def _encode(rows: List[dict]) -> bytes:
+    return zlib.compress(json.dumps(rows, ensure_ascii=False, default=str).encode('utf-8'))
+
+
+def _decode(payload: bytes) -> List[dict]:
+    return json.loads(zlib.decompress(payload))
+
+
+class DeadLetterStore:
+    """
+    Durable store for write batches that failed after all retries, backed by SQLite.
+
+    Each failed batch is kept with its table, rows (zlib-compressed JSON)
+    and error, so it can be replayed later without fetching the data from
+    the API again.
+
+    Args:
+        path: SQLite file of the store
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(SCHEMA)
+        self._lock = threading.Lock()
+        # このインスタンス (実行) で追加したdead letterの数。以前の実行の残りは含まない
+        self.added = 0
+
+    def add(self, table: str, rows: List[dict], error=None) -> int:
+        """
+        Stores a failed batch.
+
+        Returns:
+            ID of the dead letter
+        """
+        with self._lock:
+            cursor = self._conn.execute(
+                "INSERT INTO dead_letters (table_name, row_count, payload, error, created_at) VALUES (?, ?, ?, ?, ?)",
+                (table, len(rows), _encode(rows), str(error) if error is not None else None, time.time()))
+            self._conn.commit()
+            self.added += 1
+            return cursor.lastrowid
+
+    def counts(self) -> Dict[str, Tuple[int, int]]:
+        """Returns {table: (batches, rows)} of the stored dead letters."""
+        with self._lock:
+            return {table: (batches, rows) for table, batches, rows in self._conn.execute(
+                "SELECT table_name, COUNT(*), SUM(row_count) FROM dead_letters GROUP BY table_name")}
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM dead_letters").fetchone()[0]
+
+    def tables(self) -> List[str]:
+        """Returns the tables that have dead letters, parents before children."""
+        tables = set(self.counts())
+        order = [table for table in TABLE_PARENTS if table in tables]
+        return order + sorted(tables - set(order))
+
+    def iter_batches(self, table: str, max_rows: int = 10000) -> Iterator[Tuple[List[int], List[dict]]]:
+        """
+        Yields (ids, rows) for a table, merging consecutive dead letters into
+        groups of up to max_rows rows so they can be written in bulk.
+        A single dead letter larger than max_rows is yielded as is.
+        """
+        with self._lock:
+            entries = self._conn.execute(
+                "SELECT id, row_count FROM dead_letters WHERE table_name = ? ORDER BY id", (table,)).fetchall()
+
+        group_ids, group_rows = [], 0
+        for dead_letter_id, row_count in entries:
+            if group_ids and group_rows + row_count > max_rows:
+                yield group_ids, self._load(group_ids)
+                group_ids, group_rows = [], 0
+            group_ids.append(dead_letter_id)
+            group_rows += row_count
+        if group_ids:
+            yield group_ids, self._load(group_ids)
+
+    def _load(self, ids: List[int]) -> List[dict]:
+        rows = []
+        with self._lock:
+            for (payload,) in self._conn.execute(
+                    f"SELECT payload FROM dead_letters WHERE id IN ({','.join('?' * len(ids))}) ORDER BY id", ids):
+                rows.extend(_decode(payload))
+        return rows
+
+    def remove(self, ids: List[int]):
+        """Deletes dead letters that have been replayed."""
+        with self._lock:
+            self._conn.executemany("DELETE FROM dead_letters WHERE id = ?", [(i,) for i in ids])
+            self._conn.commit()
+
+    def record_failure(self, ids: List[int], error):
+        """Counts a failed replay attempt."""
+        with self._lock:
+            self._conn.executemany(
+                "UPDATE dead_letters SET attempts = attempts + 1, error = ?, last_attempt_at = ? WHERE id = ?",
+                [(str(error), time.time(), i) for i in ids])
+            self._conn.commit()
+
+    def keep_failed(self, dead_letter_id: int, rows: List[dict], error):
+        """Replaces a dead letter's rows with the ones that still failed and counts the attempt."""
+        with self._lock:
+            self._conn.execute(
+                "UPDATE dead_letters SET row_count = ?, payload = ?, attempts = attempts + 1, error = ?, "
+                "last_attempt_at = ? WHERE id = ?",
+                (len(rows), _encode(rows), str(error), time.time(), dead_letter_id))
+            self._conn.commit()
+
+    def _write_split(self, table: str, rows: List[dict], write_fn: Callable[[str, List[dict]], None],
+                     on_progress: Optional[Callable[[str, int], None]]) -> Tuple[List[dict], Optional[Exception]]:
+        # 失敗したら半分ずつ再送し、書き込めない行だけを1行単位まで絞り込む
+        try:
+            write_fn(table, rows)
+        except Exception as e:
+            if len(rows) <= 1:
+                return rows, e
+            half = len(rows) // 2
+            failed_head, error_head = self._write_split(table, rows[:half], write_fn, on_progress)
+            failed_tail, error_tail = self._write_split(table, rows[half:], write_fn, on_progress)
+            return failed_head + failed_tail, error_tail or error_head
+        if on_progress is not None:
+            on_progress(table, len(rows))
+        return [], None
+
+    def replay(self, write_fn: Callable[[str, List[dict]], None],
+               tables: Optional[List[str]] = None,
+               max_rows: int = 10000,
+               on_progress: Optional[Callable[[str, int], None]] = None) -> Dict[str, Dict[str, int]]:
+        """
+        Writes the stored batches again, parent tables first.
+
+        Successfully written dead letters are deleted. When a group fails,
+        each of its dead letters is written again on its own, halving failed
+        parts down to single rows, so one bad row does not hold back the
+        rest; only the rows that still fail stay in the store, with their
+        attempt count increased.
+
+        Args:
+            write_fn: Called as write_fn(table, rows); raises on failure
+            tables: Tables to replay (default: all)
+            max_rows: Rows per bulk write
+            on_progress: Called as on_progress(table, rows) after each successful write
+
+        Returns:
+            {table: {"rows": replayed rows, "failed": failed rows}}
+        """
+        result = {}
+        for table in tables or self.tables():
+            summary = result.setdefault(table, {"rows": 0, "failed": 0})
+            for ids, rows in self.iter_batches(table, max_rows):
+                try:
+                    write_fn(table, rows)
+                except Exception:
+                    for dead_letter_id in ids:
+                        rows = self._load([dead_letter_id])
+                        failed, error = self._write_split(table, rows, write_fn, on_progress)
+                        if failed:
+                            self.keep_failed(dead_letter_id, failed, error)
+                        else:
+                            self.remove([dead_letter_id])
+                        summary["rows"] += len(rows) - len(failed)
+                        summary["failed"] += len(failed)
+                    continue
+                self.remove(ids)
+                summary["rows"] += len(rows)
+                if on_progress is not None:
+                    on_progress(table, len(rows))
+        return result
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,139 @@
+import os
+import json
+from datetime import datetime, timezone
+from typing import Dict, List, Optional
+
+from gamma.lib.fetch_event import EventFetcher
+from gamma.lib.event_crawler import crawl_event_pages
+from gamma.lib.snapshot import OUTPUT_DIR, SnapshotWriter, iter_events
+
+WATERMARK_PATH = os.path.join(OUTPUT_DIR, "events.watermark.json")
+
+
+def parse_timestamp(value: Optional[str]) -> Optional[datetime]:
+    """Parses a Gamma API ISO timestamp (e.g. 2024-12-08T17:47:39.583Z) into an aware datetime."""
+    if not value:
+        return None
+    try:
+        parsed = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    except ValueError:
+        return None
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed
+
+
+def newer_timestamp(current: Optional[str], candidate: Optional[str]) -> Optional[str]:
+    """Returns whichever of the two ISO timestamps is later (None-safe)."""
+    candidate_ts = parse_timestamp(candidate)
+    if candidate_ts is None:
+        return current
+    current_ts = parse_timestamp(current)
+    if current_ts is None or candidate_ts > current_ts:
+        return candidate
+    return current
+
+
+def load_watermark(path: str = WATERMARK_PATH) -> Optional[dict]:
+    """
+    Loads the watermark of the last successful crawl.
+
+    Returns:
+        {"updatedAt": ..., "syncedAt": ..., "snapshot": ...} or None if no crawl has completed yet
+    """
+    if not os.path.exists(path):
+        return None
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def save_watermark(updated_at: str, snapshot_path: str, path: str = WATERMARK_PATH):
+    """Atomically records the newest updatedAt contained in snapshot_path."""
+    watermark = {
+        "updatedAt": updated_at,
+        "syncedAt": datetime.now(timezone.utc).isoformat(),
+        "snapshot": snapshot_path,
+    }
+    tmp_path = path + ".tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(watermark, f, ensure_ascii=False, indent=4)
+    os.replace(tmp_path, path)
+
+
+async def fetch_updated_events(fetcher: EventFetcher,
+                               since: str,
+                               limit: int = 100,
+                               max_events: int = 20000,
+                               concurrency: int = 4) -> List[dict]:
+    """
+    Fetches events updated at or after `since`.
+
+    Events are requested newest-updated first (order=updatedAt, ascending=False),
+    so the crawl stops at the first page that reaches past the watermark.
+
+    Args:
+        fetcher: EventFetcher instance
+        since: Watermark (ISO timestamp); events with updatedAt >= since are returned
+        limit: Page size
+        max_events: Upper bound on the offset to crawl
+        concurrency: Maximum number of page requests in flight
+
+    Returns:
+        List of updated or newly created events
+
+    Raises:
+        ValueError: `since` is not a valid ISO timestamp
+    """
+    since_ts = parse_timestamp(since)
+    if since_ts is None:
+        raise ValueError(f"Invalid watermark: {since!r}")
+    updated_events = []
+    async for _, events in crawl_event_pages(fetcher, limit=limit, max_events=max_events,
+                                             concurrency=concurrency,
+                                             order="updatedAt", ascending=False):
+        reached_watermark = False
+        for event in events:
+            event_ts = parse_timestamp(event.get('updatedAt'))
+            if event_ts is not None and event_ts < since_ts:
+                reached_watermark = True
+                continue
+            updated_events.append(event)
+        if reached_watermark:
+            break
+    return updated_events
+
+
+def merge_snapshot(snapshot_path: str, updated_events: List[dict], compress: Optional[bool] = None) -> Dict[str, int]:
+    """
+    Merges updated events into an existing snapshot by event id.
+
+    Existing events keep their position and are replaced in place; events that
+    are not in the snapshot yet are appended at the end. The merged snapshot
+    is always written as NDJSON.
+
+    Args:
+        snapshot_path: Existing snapshot (.ndjson, .ndjson.gz or legacy .json)
+        updated_events: Events returned by fetch_updated_events
+        compress: gzip the merged snapshot. If None, follows snapshot_path
+
+    Returns:
+        {"updated": ..., "added": ..., "total": ..., "path": ...}
+    """
+    if compress is None:
+        compress = snapshot_path.endswith('.gz')
+    pending = {str(event['id']): event for event in updated_events}
+    output_dir = os.path.dirname(os.path.abspath(snapshot_path))
+
+    updated = 0
+    with SnapshotWriter(os.path.join(output_dir, "events.ndjson"), compress=compress) as writer:
+        for event in iter_events(snapshot_path):
+            replacement = pending.pop(str(event['id']), None)
+            if replacement is not None:
+                event = replacement
+                updated += 1
+            writer.write_event(event)
+        added = len(pending)
+        # 新規イベントは作成順に末尾へ追加
+        writer.write_events(sorted(pending.values(), key=lambda e: parse_timestamp(e.get('createdAt')) or datetime.min.replace(tzinfo=timezone.utc)))
+
+    return {"updated": updated, "added": added, "total": writer.event_count, "path": writer.path}
@@ -1,11 +1,29 @@
+import os
+import time
 import requests
 from typing import Optional, List, Union
 from datetime import datetime
 from urllib.parse import urlencode
+from gamma.lib.http_session import get_session, DEFAULT_TIMEOUT
+from gamma.lib.rate_limiter import THROTTLE_STATUS, parse_retry_after
+
+# 429/5xx を再試行する回数と初回の待ち時間 (秒、以降は倍々)
+GAMMA_MAX_RETRIES = int(os.getenv("GAMMA_MAX_RETRIES", "5"))
+GAMMA_RETRY_BACKOFF = float(os.getenv("GAMMA_RETRY_BACKOFF", "1.0"))
 
 class EventFetcher:
-    def __init__(self, base_url: str):
+    def __init__(self, base_url: str, session: Optional[requests.Session] = None, timeout: float = DEFAULT_TIMEOUT,
+                 max_retries: int = GAMMA_MAX_RETRIES, retry_backoff: float = GAMMA_RETRY_BACKOFF):
         self.base_url = base_url
+        self._session = session
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+
+    @property
+    def session(self) -> requests.Session:
+        # 未指定の場合はスレッド間で共有する接続プールを使う
+        return self._session if self._session is not None else get_session()
 
     def fetch_events(self,
                     limit: Optional[int] = None,
@@ -90,5 +108,26 @@ class EventFetcher:
         if params:
             url = f"{url}?{urlencode(params, doseq=True)}"
         # print("url:", url)
-        response = requests.get(url)
-        return response.json()
\ No newline at end of file
+        response = self._get(url)
+        # リトライ後もエラーの場合はエラーのJSONをページとして返さず例外にする
+        response.raise_for_status()
+        return response.json()
+
+    def _get(self, url: str) -> requests.Response:
+        """
+        GETs a URL, retrying throttled responses (429/5xx) with exponential backoff.
+
+        Retry-After is honored when it asks for a longer wait than the backoff.
+        The last response is returned once retries run out.
+        """
+        for attempt in range(self.max_retries + 1):
+            response = self.session.get(url, timeout=self.timeout)
+            if response.status_code not in THROTTLE_STATUS or attempt == self.max_retries:
+                return response
+            wait = self.retry_backoff * (2 ** attempt)
+            retry_after = parse_retry_after(response.headers.get("Retry-After"))
+            if retry_after is not None:
+                wait = max(wait, retry_after)
+            response.close()
+            time.sleep(wait)
+        return response
@@ -0,0 +1,96 @@
+import os
+import threading
+from typing import Dict, Optional
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from gamma.lib.rate_limiter import get_limiter, parse_retry_after
+
+# 環境変数で上書き可能な接続プール設定
+DEFAULT_POOL_MAXSIZE = int(os.getenv("HTTP_POOL_MAXSIZE", "100"))
+DEFAULT_TIMEOUT = float(os.getenv("HTTP_TIMEOUT", "30"))
+
+# ホストごとの同時接続数の上限
+HOST_POOL_LIMITS = {
+    "gamma-api.polymarket.com": int(os.getenv("GAMMA_POOL_MAXSIZE", "16")),
+    "clob.polymarket.com": int(os.getenv("CLOB_POOL_MAXSIZE", str(DEFAULT_POOL_MAXSIZE))),
+}
+
+_session = None
+_session_lock = threading.Lock()
+
+
+class RateLimitedSession(requests.Session):
+    """Session that routes every request through the per-host AdaptiveRateLimiter."""
+
+    def request(self, method, url, *args, **kwargs):
+        limiter = get_limiter(urlparse(url).hostname or "")
+        with limiter.limit() as record:
+            response = super().request(method, url, *args, **kwargs)
+            record(response.status_code, parse_retry_after(response.headers.get("Retry-After")))
+            return response
+
+
+def _make_adapter(pool_maxsize: int) -> HTTPAdapter:
+    # 接続レベルのエラー (SSL EOF等) のみここでリトライし、429/5xx は呼び出し側 (EventFetcher等) で再試行する
+    retry = Retry(total=3, connect=3, read=2, status=0, backoff_factor=0.5,
+                  allowed_methods=frozenset(["GET"]), raise_on_status=False)
+    # pool_block=True: 上限を超えた場合は新規接続を作らず空きを待つ
+    return HTTPAdapter(pool_connections=1, pool_maxsize=pool_maxsize,
+                       pool_block=True, max_retries=retry)
+
+
+def create_session(pool_maxsize: int = DEFAULT_POOL_MAXSIZE,
+                   host_limits: Optional[Dict[str, int]] = None) -> requests.Session:
+    """
+    Creates a keep-alive session with pooled connections.
+
+    Args:
+        pool_maxsize: Maximum number of pooled connections for hosts without an explicit limit
+        host_limits: Maximum number of connections per host (e.g. {"clob.polymarket.com": 50})
+
+    Returns:
+        requests.Session that can be shared across threads (rate limited per host)
+    """
+    if host_limits is None:
+        host_limits = HOST_POOL_LIMITS
+
+    session = RateLimitedSession()
+    session.headers.update({
+        "Accept-Encoding": "gzip, deflate",
+        "Connection": "keep-alive",
+    })
+    session.mount("https://", _make_adapter(pool_maxsize))
+    session.mount("http://", _make_adapter(pool_maxsize))
+    for host, limit in host_limits.items():
+        session.mount(f"https://{host}", _make_adapter(limit))
+    return session
+
+
+def get_session() -> requests.Session:
+    """Returns the process-wide session, creating it on first use."""
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                _session = create_session()
+    return _session
+
+
+def configure_session(pool_maxsize: int = DEFAULT_POOL_MAXSIZE,
+                      host_limits: Optional[Dict[str, int]] = None) -> requests.Session:
+    """
+    Replaces the process-wide session with one using the given pool settings.
+
+    Call this before starting worker threads.
+    """
+    global _session
+    with _session_lock:
+        old_session = _session
+        _session = create_session(pool_maxsize, host_limits)
+    if old_session is not None:
+        old_session.close()
+    return _session
@@ -0,0 +1,162 @@
+import threading
+from typing import Dict, Iterable, List, Optional, Tuple
+
+# テーブルごとの主キー (upsertの競合ターゲット)
+KEY_COLUMNS = {
+    "events": ("id",),
+    "markets": ("id",),
+    "tags": ("event_id", "id"),
+    "prices": ("market_id", "timestamp"),
+    "token_prices": ("market_id", "token_id", "timestamp"),
+}
+
+CONFLICT_TARGETS = {table: ",".join(columns) for table, columns in KEY_COLUMNS.items()}
+
+# マーケットごとの最新時刻を返すRPC (作成するSQLはREADME参照)。
+# PostgRESTの集計関数はSupabaseで既定で無効なため、こちらを優先する
+PRICE_WATERMARK_RPC = "price_watermarks"
+TOKEN_WATERMARK_RPC = "token_price_watermarks"
+
+
+def row_key(table: str, row: dict) -> Tuple[str, ...]:
+    return tuple(str(row.get(column)) for column in KEY_COLUMNS[table])
+
+
+class KnownKeys:
+    """
+    Primary keys the database already has, prefetched in bulk before a load.
+
+    events/markets/tags are tracked as exact key sets. prices are tracked as
+    the latest stored timestamp per market (token_prices: per market and
+    token), since price history is only ever appended to.
+    """
+
+    def __init__(self):
+        self._keys: Dict[str, set] = {}
+        self._price_watermarks: Dict[str, int] = {}
+        self._token_watermarks: Dict[Tuple[str, str], int] = {}
+        self._lock = threading.Lock()
+
+    def load_keys(self, client, table: str, page_size: int = 1000) -> int:
+        """
+        Pages through the primary keys of a table.
+
+        Returns:
+            Number of keys loaded
+        """
+        columns = KEY_COLUMNS[table]
+        loaded = 0
+        start = 0
+        while True:
+            query = client.table(table).select(",".join(columns))
+            for column in columns:
+                query = query.order(column)
+            rows = query.range(start, start + page_size - 1).execute().data
+            self.add(table, rows)
+            loaded += len(rows)
+            if len(rows) < page_size:
+                return loaded
+            start += page_size
+
+    @staticmethod
+    def _max_timestamps(client, function: str, table: str, columns: str, market_ids: List[str]) -> List[dict]:
+        try:
+            return client.rpc(function, {"market_ids": market_ids}).execute().data
+        except Exception:
+            # RPCが未作成の場合は集計関数を試す (無効であれば例外がそのまま呼び出し側に届く)
+            return (client.table(table).select(f"{columns},max_timestamp:timestamp.max()")
+                    .in_("market_id", market_ids).execute().data)
+
+    def load_price_watermarks(self, client, market_ids: Iterable[str], chunk_size: int = 200) -> int:
+        """
+        Loads max(timestamp) of prices per market in chunks of market ids.
+
+        Uses the price_watermarks RPC (see README), falling back to PostgREST
+        aggregate functions, which Supabase disables by default.
+
+        Returns:
+            Number of markets that already have prices
+
+        Raises:
+            The error of the fallback query if neither is available
+        """
+        market_ids = list(market_ids)
+        loaded = 0
+        for i in range(0, len(market_ids), chunk_size):
+            chunk = market_ids[i:i + chunk_size]
+            rows = self._max_timestamps(client, PRICE_WATERMARK_RPC, "prices", "market_id", chunk)
+            with self._lock:
+                for row in rows:
+                    if row.get("max_timestamp") is not None:
+                        self._price_watermarks[str(row["market_id"])] = int(row["max_timestamp"])
+                        loaded += 1
+        return loaded
+
+    def load_token_watermarks(self, client, market_ids: Iterable[str], chunk_size: int = 200) -> int:
+        """
+        Loads max(timestamp) of token_prices per market and token, like load_price_watermarks.
+
+        Returns:
+            Number of (market, token) series that already have prices
+        """
+        market_ids = list(market_ids)
+        loaded = 0
+        for i in range(0, len(market_ids), chunk_size):
+            chunk = market_ids[i:i + chunk_size]
+            rows = self._max_timestamps(client, TOKEN_WATERMARK_RPC, "token_prices", "market_id,token_id", chunk)
+            with self._lock:
+                for row in rows:
+                    if row.get("max_timestamp") is not None:
+                        self._token_watermarks[(str(row["market_id"]), str(row["token_id"]))] = int(row["max_timestamp"])
+                        loaded += 1
+        return loaded
+
+    def add(self, table: str, rows: List[dict]):
+        """Marks rows as present in the database."""
+        if table == "token_prices":
+            with self._lock:
+                for row in rows:
+                    series = (str(row["market_id"]), str(row["token_id"]))
+                    if row["timestamp"] > self._token_watermarks.get(series, -1):
+                        self._token_watermarks[series] = row["timestamp"]
+            return
+        if table == "prices":
+            with self._lock:
+                for row in rows:
+                    market_id = str(row["market_id"])
+                    if row["timestamp"] > self._price_watermarks.get(market_id, -1):
+                        self._price_watermarks[market_id] = row["timestamp"]
+            return
+        keys = [row_key(table, row) for row in rows]
+        with self._lock:
+            self._keys.setdefault(table, set()).update(keys)
+
+    def contains(self, table: str, row: dict) -> bool:
+        with self._lock:
+            return row_key(table, row) in self._keys.get(table, ())
+
+    def price_watermark(self, market_id) -> Optional[int]:
+        """Returns the latest stored price timestamp of a market, or None."""
+        with self._lock:
+            return self._price_watermarks.get(str(market_id))
+
+    def token_watermark(self, market_id, token_id) -> Optional[int]:
+        """Returns the latest stored token_prices timestamp of a market's token, or None."""
+        with self._lock:
+            return self._token_watermarks.get((str(market_id), str(token_id)))
+
+    def filter_new(self, table: str, rows: List[dict]) -> List[dict]:
+        """
+        Drops rows the database already has.
+        """
+        if table == "token_prices":
+            with self._lock:
+                return [row for row in rows
+                        if row["timestamp"] > self._token_watermarks.get((str(row["market_id"]), str(row["token_id"])), -1)]
+        if table == "prices":
+            with self._lock:
+                return [row for row in rows
+                        if row["timestamp"] > self._price_watermarks.get(str(row["market_id"]), -1)]
+        with self._lock:
+            known = self._keys.get(table, ())
+            return [row for row in rows if row_key(table, row) not in known]
@@ -0,0 +1,309 @@
+import os
+import sys
+import time
+import bisect
+import threading
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+# 秒単位のレイテンシ用バケット
+DEFAULT_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _label_key(labelnames: Sequence[str], labels: Dict[str, str]) -> Tuple[str, ...]:
+    if set(labels) != set(labelnames):
+        raise ValueError(f"Expected labels {list(labelnames)}, got {list(labels)}")
+    return tuple(str(labels[name]) for name in labelnames)
+
+
+def _format_labels(labelnames: Sequence[str], values: Tuple[str, ...], extra: str = "") -> str:
+    pairs = [f'{name}="{value}"' for name, value in zip(labelnames, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Counter:
+    """Monotonically increasing count, optionally split by labels."""
+
+    type = "counter"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels):
+        key = _label_key(self.labelnames, labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        """Returns the count of a label set, or the sum over all label sets if none are given."""
+        with self._lock:
+            if not labels and self.labelnames:
+                return sum(self._values.values())
+            return self._values.get(_label_key(self.labelnames, labels), 0)
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            return [f"{self.name}{_format_labels(self.labelnames, key)} {value}"
+                    for key, value in sorted(self._values.items())]
+
+
+class Gauge:
+    """
+    Value that can go up and down. Either set explicitly or read from a
+    callback when the metrics are rendered.
+    """
+
+    type = "gauge"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._functions: Dict[Tuple[str, ...], Callable[[], float]] = {}
+        self._lock = threading.Lock()
+
+    def set(self, value: float, **labels):
+        with self._lock:
+            self._values[_label_key(self.labelnames, labels)] = value
+
+    def inc(self, amount: float = 1, **labels):
+        key = _label_key(self.labelnames, labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def set_function(self, fn: Callable[[], float], **labels):
+        with self._lock:
+            self._functions[_label_key(self.labelnames, labels)] = fn
+
+    def value(self, **labels) -> float:
+        key = _label_key(self.labelnames, labels)
+        with self._lock:
+            fn = self._functions.get(key)
+            if fn is None:
+                return self._values.get(key, 0)
+        return fn()
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            values = dict(self._values)
+            functions = dict(self._functions)
+        for key, fn in functions.items():
+            values[key] = fn()
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {value}"
+                for key, value in sorted(values.items())]
+
+
+class Histogram:
+    """Distribution of observed values (e.g. latencies) in cumulative buckets."""
+
+    type = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # ラベルごとに [バケットごとの件数..., +Inf], 合計, 件数
+        self._counts: Dict[Tuple[str, ...], List[int]] = {}
+        self._sums: Dict[Tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        key = _label_key(self.labelnames, labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts = self._counts.setdefault(key, [0] * (len(self.buckets) + 1))
+            counts[index] += 1
+            self._sums[key] = self._sums.get(key, 0.0) + value
+
+    @contextmanager
+    def time(self, **labels):
+        """Observes the seconds spent in the with-block."""
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.observe(time.monotonic() - start, **labels)
+
+    def count(self, **labels) -> int:
+        with self._lock:
+            return sum(self._counts.get(_label_key(self.labelnames, labels), ()))
+
+    def quantile(self, q: float, **labels) -> Optional[float]:
+        """
+        Estimates a quantile by linear interpolation within its bucket, like
+        Prometheus' histogram_quantile. Returns None if nothing was observed.
+        """
+        with self._lock:
+            counts = list(self._counts.get(_label_key(self.labelnames, labels), ()))
+        total = sum(counts)
+        if total == 0:
+            return None
+        rank = q * total
+        cumulative = 0
+        for i, count in enumerate(counts):
+            if cumulative + count >= rank and count > 0:
+                if i == len(self.buckets):
+                    return self.buckets[-1]
+                lower = self.buckets[i - 1] if i > 0 else 0.0
+                return lower + (self.buckets[i] - lower) * (rank - cumulative) / count
+            cumulative += count
+        return self.buckets[-1]
+
+    def samples(self) -> List[str]:
+        lines = []
+        with self._lock:
+            items = sorted((key, list(counts), self._sums[key]) for key, counts in self._counts.items())
+        for key, counts, total in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = 'le="+Inf"' if bound == float("inf") else f'le="{bound}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {total}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {cumulative}")
+        return lines
+
+
+class MetricsRegistry:
+    """
+    Collection of metrics that can be rendered in the Prometheus text format.
+    """
+
+    def __init__(self):
+        self._metrics: Dict[str, object] = {}
+        self._lock = threading.Lock()
+
+    def _register(self, cls, name: str, *args, **kwargs):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = cls(name, *args, **kwargs)
+            elif not isinstance(metric, cls):
+                raise ValueError(f"Metric {name} is already registered as a {metric.type}")
+            return metric
+
+    def counter(self, name: str, help: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self._register(Counter, name, help, labelnames)
+
+    def gauge(self, name: str, help: str, labelnames: Sequence[str] = ()) -> Gauge:
+        return self._register(Gauge, name, help, labelnames)
+
+    def histogram(self, name: str, help: str, labelnames: Sequence[str] = (),
+                  buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram, name, help, labelnames, buckets)
+
+    def render(self) -> str:
+        """Returns every metric in the Prometheus text exposition format."""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            lines.extend(metric.samples())
+        return "\n".join(lines) + "\n"
+
+    def write_textfile(self, path: str):
+        """Writes the metrics atomically (for node_exporter's textfile collector)."""
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(self.render())
+        os.replace(tmp_path, path)
+
+    def start_http_server(self, port: int, addr: str = "127.0.0.1") -> ThreadingHTTPServer:
+        """Serves the metrics at http://addr:port/metrics from a daemon thread."""
+        registry = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                body = registry.render().encode('utf-8')
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        server = ThreadingHTTPServer((addr, port), Handler)
+        threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+        return server
+
+
+class MetricsReporter:
+    """
+    Background thread that periodically prints a one-line summary and
+    refreshes the Prometheus text file.
+
+    Args:
+        summary_fn: Returns the summary line; called with the seconds since the previous report
+        interval: Seconds between reports
+        registry: Registry to write to `textfile`
+        textfile: Path of the Prometheus text file (None = console only)
+    """
+
+    def __init__(self, summary_fn: Callable[[float], str], interval: float = 10.0,
+                 registry: Optional[MetricsRegistry] = None, textfile: Optional[str] = None):
+        self.summary_fn = summary_fn
+        self.interval = interval
+        self.registry = registry
+        self.textfile = textfile
+        self._stopped = threading.Event()
+        self._last_report = time.monotonic()
+        self._thread = threading.Thread(target=self._loop, name="metrics-reporter", daemon=True)
+
+    def start(self) -> "MetricsReporter":
+        self._thread.start()
+        return self
+
+    def report(self):
+        now = time.monotonic()
+        line = self.summary_fn(now - self._last_report)
+        self._last_report = now
+        # 端末では同じ行を上書きする
+        if sys.stdout.isatty():
+            sys.stdout.write("\r\033[K" + line)
+        else:
+            sys.stdout.write(line + "\n")
+        sys.stdout.flush()
+        if self.registry is not None and self.textfile:
+            self.registry.write_textfile(self.textfile)
+
+    def _loop(self):
+        while not self._stopped.wait(self.interval):
+            self.report()
+
+    def stop(self):
+        """Stops the thread and prints a final report."""
+        self._stopped.set()
+        if self._thread.is_alive():
+            self._thread.join()
+        self.report()
+        if sys.stdout.isatty():
+            sys.stdout.write("\n")
+
+
+REGISTRY = MetricsRegistry()
+
+# CLOB /prices-history
+PRICEHISTORY_REQUESTS = REGISTRY.counter(
+    "pricehistory_requests_total", "Requests to /prices-history by outcome", ["outcome"])
+PRICEHISTORY_RETRIES = REGISTRY.counter(
+    "pricehistory_retries_total", "Retried /prices-history requests")
+PRICEHISTORY_LATENCY = REGISTRY.histogram(
+    "pricehistory_request_seconds", "Latency of /prices-history requests")
+PRICEHISTORY_SKIPPED = REGISTRY.counter(
+    "pricehistory_skipped_total", "Price history fetches skipped by the negative cache by reason", ["reason"])
@@ -0,0 +1,194 @@
+import os
+import csv
+import time
+import sqlite3
+import threading
+from typing import Dict, Optional, Tuple
+
+DEFAULT_NEGATIVE_CACHE_PATH = os.getenv(
+    "NEGATIVE_CACHE_PATH",
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "output", "state", "negative_cache.db"))
+# エントリの有効期間 (秒)。0の場合は無期限
+DEFAULT_NEGATIVE_TTL = int(os.getenv("NEGATIVE_CACHE_TTL", str(7 * 24 * 3600)))
+
+# 価格履歴を取得しない理由
+EMPTY_HISTORY = "empty_history"      # クローズ済みで履歴が空だった
+MISSING_FIELDS = "missing_fields"    # startDate/endDate/clobTokenIds が無い
+INACTIVE = "inactive"                # activeでない、またはarchived
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS negative (
+    market_id TEXT NOT NULL,
+    token_id TEXT NOT NULL,
+    reason TEXT NOT NULL,
+    updated_at TEXT,
+    created_at INTEGER NOT NULL,
+    PRIMARY KEY (market_id, token_id)
+);
+"""
+
+# token_idが空のエントリはマーケットの全トークンに適用する
+ANY_TOKEN = ""
+
+
+class NegativeCache:
+    """
+    Persistent record of markets (or single outcome tokens) known to have
+    no price history to fetch, backed by SQLite.
+
+    The fetch layer checks it before issuing any request, so markets that
+    are known to be empty cost zero requests on later runs. Entries expire
+    after `ttl` seconds, and an entry is ignored when the market's
+    updatedAt differs from the one recorded with it (the market changed
+    since, e.g. it became active).
+
+    Args:
+        path: SQLite file of the cache
+        ttl: Seconds an entry stays valid (0 = forever)
+    """
+
+    def __init__(self, path: str = DEFAULT_NEGATIVE_CACHE_PATH, ttl: int = DEFAULT_NEGATIVE_TTL):
+        self.path = path
+        self.ttl = ttl
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(SCHEMA)
+        self._lock = threading.Lock()
+
+        self._entries: Dict[Tuple[str, str], Tuple[str, Optional[str], int]] = {}
+        for market_id, token_id, reason, updated_at, created_at in self._conn.execute(
+                "SELECT market_id, token_id, reason, updated_at, created_at FROM negative"):
+            self._entries[(market_id, token_id)] = (reason, updated_at, created_at)
+
+    def _expired(self, created_at: int, now: float) -> bool:
+        return self.ttl > 0 and now - created_at >= self.ttl
+
+    def get(self, market_id, token_id=None, updated_at: Optional[str] = None) -> Optional[str]:
+        """
+        Returns the reason a market (or one of its tokens) has nothing to fetch, or None.
+
+        Args:
+            market_id: Market ID
+            token_id: CLOB token ID (market-wide entries match every token)
+            updated_at: updatedAt of the market; entries recorded with a different one are ignored
+        """
+        now = time.time()
+        keys = [(str(market_id), ANY_TOKEN)]
+        if token_id is not None:
+            keys.append((str(market_id), str(token_id)))
+        with self._lock:
+            for key in keys:
+                entry = self._entries.get(key)
+                if entry is None:
+                    continue
+                reason, recorded_updated_at, created_at = entry
+                if self._expired(created_at, now):
+                    continue
+                if updated_at is not None and recorded_updated_at is not None and updated_at != recorded_updated_at:
+                    continue
+                return reason
+        return None
+
+    def add(self, market_id, reason: str, token_id=None, updated_at: Optional[str] = None,
+            created_at: Optional[int] = None):
+        """
+        Records that a market (or one of its tokens, if token_id is given) has nothing to fetch.
+        """
+        key = (str(market_id), ANY_TOKEN if token_id is None else str(token_id))
+        created_at = int(time.time()) if created_at is None else created_at
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO negative (market_id, token_id, reason, updated_at, created_at) "
+                "VALUES (?, ?, ?, ?, ?)", key + (reason, updated_at, created_at))
+            self._conn.commit()
+            self._entries[key] = (reason, updated_at, created_at)
+
+    def discard(self, market_id, token_id=None):
+        """
+        Forgets a market: every entry of it (market-wide and per token), or only one token if token_id is given.
+        """
+        market_id = str(market_id)
+        with self._lock:
+            if token_id is None:
+                self._conn.execute("DELETE FROM negative WHERE market_id = ?", (market_id,))
+                keys = [key for key in self._entries if key[0] == market_id]
+            else:
+                key = (market_id, str(token_id))
+                self._conn.execute("DELETE FROM negative WHERE market_id = ? AND token_id = ?", key)
+                keys = [key]
+            self._conn.commit()
+            for key in keys:
+                self._entries.pop(key, None)
+
+    def import_csv(self, path: str, reason: str = EMPTY_HISTORY) -> int:
+        """
+        Imports a closed_no.csv written by fetch_closed_market_pricehistory
+        (market_id,startDate,endDate,createdAt per line) as market-wide entries.
+
+        Returns:
+            Number of imported markets
+        """
+        now = int(time.time())
+        rows = {}
+        with open(path, 'r', encoding='utf-8', newline='') as f:
+            for line in csv.reader(f):
+                if line and line[0].strip():
+                    rows[line[0].strip()] = (line[0].strip(), ANY_TOKEN, reason, None, now)
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO negative (market_id, token_id, reason, updated_at, created_at) "
+                "VALUES (?, ?, ?, ?, ?)", list(rows.values()))
+            self._conn.commit()
+            for market_id, token_id, reason, updated_at, created_at in rows.values():
+                self._entries[(market_id, token_id)] = (reason, updated_at, created_at)
+        return len(rows)
+
+    def purge_expired(self) -> int:
+        """
+        Deletes expired entries.
+
+        Returns:
+            Number of deleted entries
+        """
+        if self.ttl <= 0:
+            return 0
+        cutoff = int(time.time()) - self.ttl
+        with self._lock:
+            deleted = self._conn.execute("DELETE FROM negative WHERE created_at <= ?", (cutoff,)).rowcount
+            self._conn.commit()
+            self._entries = {key: entry for key, entry in self._entries.items() if entry[2] > cutoff}
+        return deleted
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM negative")
+            self._conn.commit()
+            self._entries.clear()
+
+    def counts(self) -> Dict[str, int]:
+        """Returns the number of valid entries per reason."""
+        now = time.time()
+        counts = {}
+        with self._lock:
+            for reason, _, created_at in self._entries.values():
+                if not self._expired(created_at, now):
+                    counts[reason] = counts.get(reason, 0) + 1
+        return counts
+
+    def __len__(self) -> int:
+        return sum(self.counts().values())
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+def default_negative_cache() -> Optional[NegativeCache]:
+    """Returns a cache using the environment settings, or None if NEGATIVE_CACHE=0."""
+    if os.getenv("NEGATIVE_CACHE", "1") == "0":
+        return None
+    return NegativeCache()
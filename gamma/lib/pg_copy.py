@@ -0,0 +1,181 @@
+import io
+import os
+import csv
+import json
+import threading
+from typing import Iterable, Optional, Sequence
+
+import psycopg2
+from psycopg2 import pool, sql
+
+from gamma.lib.known_keys import KEY_COLUMNS
+from gamma.lib.record_mappers import MAPPERS
+from gamma.lib.sinks import PRICE_TABLES
+
+# テーブルごとのCOPY対象列
+COPY_COLUMNS = {table: mapper.columns for table, mapper in MAPPERS.items()}
+
+
+def _csv_value(value):
+    # list/dict (outcomes, clob_token_ids, ...) はPythonのreprではなくJSONとして書く
+    if isinstance(value, (list, dict)):
+        return json.dumps(value, ensure_ascii=False)
+    return value
+
+
+class _CsvRowReader(io.TextIOBase):
+    """
+    File-like object that encodes rows as CSV lazily, so COPY can stream
+    an arbitrarily large iterable without building the whole payload.
+    """
+
+    def __init__(self, rows: Iterable, columns: Sequence[str]):
+        self._rows = iter(rows)
+        self._columns = columns
+        self._buffer = io.StringIO()
+        self._writer = csv.writer(self._buffer, lineterminator='\n')
+        self._pending = ""
+        self.row_count = 0
+
+    def readable(self):
+        return True
+
+    def _next_chunk(self, size: int) -> str:
+        # 1行ずつCSVに変換し、要求サイズに達するまで溜める
+        for row in self._rows:
+            # None は空欄 (CSV形式ではNULL) として書かれる
+            # タプル (RecordMapper.to_tuple) は列順のまま、dictは列名で取り出す
+            if isinstance(row, tuple):
+                self._writer.writerow([_csv_value(value) for value in row])
+            else:
+                self._writer.writerow([_csv_value(row.get(column)) for column in self._columns])
+            self.row_count += 1
+            if self._buffer.tell() >= size:
+                break
+        chunk = self._buffer.getvalue()
+        self._buffer.seek(0)
+        self._buffer.truncate()
+        return chunk
+
+    def read(self, size: int = -1) -> str:
+        if size is None or size < 0:
+            size = 1 << 62
+        while len(self._pending) < size:
+            chunk = self._next_chunk(max(size - len(self._pending), 8192))
+            if not chunk:
+                break
+            self._pending += chunk
+        result, self._pending = self._pending[:size], self._pending[size:]
+        return result
+
+
+class PostgresCopySink:
+    """
+    Bulk writer that streams rows straight into Postgres with COPY.
+
+    Rows are copied into a temporary staging table and merged into the
+    target table with INSERT ... SELECT ... ON CONFLICT, so the load is
+    idempotent and duplicate rows are ignored (or updated) by the database.
+    Connections are pooled so the sink can be shared by several threads.
+
+    Args:
+        dsn: libpq connection string. Defaults to the DATABASE_URL env variable
+        table: Target table
+        columns: Columns to copy (default: COPY_COLUMNS[table])
+        conflict_columns: Conflict target (default: KEY_COLUMNS[table])
+        update: Update existing rows instead of ignoring them. Ignored for
+            prices/token_prices, which are immutable (same as SupabaseSink)
+        max_connections: Size of the connection pool
+    """
+
+    def __init__(self,
+                 dsn: Optional[str] = None,
+                 table: str = "prices",
+                 columns: Optional[Sequence[str]] = None,
+                 conflict_columns: Optional[Sequence[str]] = None,
+                 update: bool = False,
+                 max_connections: int = 4):
+        dsn = dsn or os.getenv("DATABASE_URL")
+        if not dsn:
+            raise ValueError("DATABASE_URL is not set")
+        self.table = table
+        self.columns = tuple(columns or COPY_COLUMNS[table])
+        self.conflict_columns = tuple(conflict_columns or KEY_COLUMNS[table])
+        self.update = update and table not in PRICE_TABLES
+        self.staging_table = f"{table}_staging"
+        self._pool = pool.ThreadedConnectionPool(1, max_connections, dsn)
+        self._lock = threading.Lock()
+        self.rows_copied = 0
+        self.rows_inserted = 0
+
+        self._create_staging = sql.SQL(
+            "CREATE TEMP TABLE IF NOT EXISTS {staging} (LIKE {table} INCLUDING DEFAULTS) ON COMMIT DELETE ROWS"
+        ).format(staging=sql.Identifier(self.staging_table), table=sql.Identifier(table))
+        self._copy = sql.SQL("COPY {staging} ({columns}) FROM STDIN WITH (FORMAT csv)").format(
+            staging=sql.Identifier(self.staging_table),
+            columns=sql.SQL(", ").join(map(sql.Identifier, self.columns)))
+        self._merge = self._build_merge()
+
+    def _build_merge(self) -> sql.Composed:
+        columns = sql.SQL(", ").join(map(sql.Identifier, self.columns))
+        conflict = sql.SQL(", ").join(map(sql.Identifier, self.conflict_columns))
+        if not self.update:
+            return sql.SQL(
+                "INSERT INTO {table} ({columns}) SELECT {columns} FROM {staging} "
+                "ON CONFLICT ({conflict}) DO NOTHING"
+            ).format(table=sql.Identifier(self.table), columns=columns,
+                     staging=sql.Identifier(self.staging_table), conflict=conflict)
+        # DO UPDATEは同一コマンド内で同じ行を2回更新できないため、バッチ内の重複を先に除く
+        updates = sql.SQL(", ").join(
+            sql.SQL("{column} = EXCLUDED.{column}").format(column=sql.Identifier(column))
+            for column in self.columns if column not in self.conflict_columns)
+        return sql.SQL(
+            "INSERT INTO {table} ({columns}) SELECT DISTINCT ON ({conflict}) {columns} FROM {staging} "
+            "ON CONFLICT ({conflict}) DO UPDATE SET {updates}"
+        ).format(table=sql.Identifier(self.table), columns=columns,
+                 staging=sql.Identifier(self.staging_table), conflict=conflict, updates=updates)
+
+    def write(self, rows: Iterable) -> int:
+        """
+        Copies rows into the target table in a single transaction.
+
+        Args:
+            rows: Iterable of row dicts, or tuples in column order
+                (RecordMapper.to_tuple). Consumed lazily, so a generator over
+                millions of rows is streamed without being materialized
+
+        Returns:
+            Number of rows newly inserted (or updated)
+        """
+        reader = _CsvRowReader(rows, self.columns)
+        conn = self._pool.getconn()
+        try:
+            with conn:
+                with conn.cursor() as cur:
+                    cur.execute(self._create_staging)
+                    cur.copy_expert(self._copy, reader)
+                    cur.execute(self._merge)
+                    inserted = cur.rowcount
+        finally:
+            # 切断された接続はプールに戻さず閉じる
+            self._pool.putconn(conn, close=bool(conn.closed))
+        with self._lock:
+            self.rows_copied += reader.row_count
+            self.rows_inserted += inserted
+        return inserted
+
+    def __call__(self, table: str, rows: Iterable[dict]) -> int:
+        """BatchWriter-compatible flush function for the sink's table."""
+        if table != self.table:
+            raise ValueError(f"PostgresCopySink for {self.table} cannot write {table}")
+        return self.write(rows)
+
+    def close(self):
+        self._pool.closeall()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
@@ -0,0 +1,124 @@
+import queue
+import logging
+import threading
+from typing import Any, Callable, Dict, List, Optional
+
+# ワーカーに終了を伝える番兵
+_STOP = object()
+
+
+class Stage:
+    """
+    One step of a Pipeline.
+
+    Args:
+        name: Stage name (used in stats and error reports)
+        fn: Called as fn(item). Its return value is passed to the next stage;
+            None drops the item
+        workers: Number of worker threads of the stage
+        queue_size: Capacity of the stage's input queue. put() blocks while it is full
+    """
+
+    def __init__(self, name: str, fn: Callable[[Any], Any], workers: int = 1, queue_size: int = 100):
+        self.name = name
+        self.fn = fn
+        self.workers = workers
+        self.queue_size = queue_size
+
+
+class Pipeline:
+    """
+    Chain of stages connected by bounded queues, each with its own worker pool.
+
+    Items put into the pipeline flow through the stages in order. Since
+    every queue is bounded, a slow stage blocks the stage in front of it
+    (and finally put()), which keeps the number of items in memory bounded.
+
+    Args:
+        stages: Stages in processing order
+        on_error: Called as on_error(stage_name, item, exception) when a stage
+            function raises. The item is dropped. Defaults to logging the exception
+    """
+
+    def __init__(self, stages: List[Stage],
+                 on_error: Optional[Callable[[str, Any, Exception], None]] = None):
+        if not stages:
+            raise ValueError("Pipeline needs at least one stage")
+        self.stages = stages
+        self.on_error = on_error
+        self._queues = [queue.Queue(maxsize=stage.queue_size) for stage in stages]
+        self._threads: List[List[threading.Thread]] = []
+        self._lock = threading.Lock()
+        self._processed = {stage.name: 0 for stage in stages}
+        self._errors = {stage.name: 0 for stage in stages}
+        self._closed = False
+
+        for i, stage in enumerate(stages):
+            threads = [threading.Thread(target=self._worker, args=(i,), name=f"{stage.name}-{n}", daemon=True)
+                       for n in range(stage.workers)]
+            for thread in threads:
+                thread.start()
+            self._threads.append(threads)
+
+    def _worker(self, index: int):
+        stage = self.stages[index]
+        inbox = self._queues[index]
+        outbox = self._queues[index + 1] if index + 1 < len(self._queues) else None
+        while True:
+            item = inbox.get()
+            if item is _STOP:
+                return
+            try:
+                result = stage.fn(item)
+            except Exception as e:
+                with self._lock:
+                    self._errors[stage.name] += 1
+                if self.on_error is None:
+                    logging.getLogger(__name__).exception(f"Error in stage {stage.name}")
+                    continue
+                # on_errorの例外でワーカーが止まると前段のput()が詰まるため、ここで握りつぶす
+                try:
+                    self.on_error(stage.name, item, e)
+                except Exception:
+                    logging.getLogger(__name__).exception(f"Error in on_error of stage {stage.name}")
+                continue
+            with self._lock:
+                self._processed[stage.name] += 1
+            if outbox is not None and result is not None:
+                # 次のステージが詰まっている間はここで待つ (バックプレッシャー)
+                outbox.put(result)
+
+    def put(self, item: Any):
+        """Feeds an item into the first stage, blocking while its queue is full."""
+        if self._closed:
+            raise RuntimeError("Pipeline is closed")
+        self._queues[0].put(item)
+
+    def close(self):
+        """
+        Waits until every item put so far has gone through all stages, then stops the workers.
+        """
+        if self._closed:
+            return
+        self._closed = True
+        # 前段のワーカーが全て終わってから次段を止めるため、残りの項目も処理される
+        for inbox, threads in zip(self._queues, self._threads):
+            for _ in threads:
+                inbox.put(_STOP)
+            for thread in threads:
+                thread.join()
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        """Returns processed/error counts and current queue depth per stage."""
+        with self._lock:
+            return {stage.name: {"processed": self._processed[stage.name],
+                                 "errors": self._errors[stage.name],
+                                 "queued": inbox.qsize()}
+                    for stage, inbox in zip(self.stages, self._queues)}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
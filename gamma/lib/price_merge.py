@@ -0,0 +1,106 @@
+import threading
+from typing import Dict, Hashable, List, Tuple
+
+import numpy as np
+
+from gamma.lib.known_keys import KEY_COLUMNS
+
+TIMESTAMP_DTYPE = np.dtype('<i8')
+# シリーズを直列化するロックの数
+LOCK_STRIPES = 64
+
+
+def merge_new(known: np.ndarray, timestamps: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Unions incoming timestamps into a sorted set of known timestamps.
+
+    Incoming timestamps are looked up with a binary search and the net-new
+    ones are inserted in place, so a batch of k points against n known ones
+    costs O(k log k + k log n) plus a single copy of the known array (no
+    re-sort of the whole set).
+
+    Args:
+        known: Sorted, unique int64 timestamps
+        timestamps: Incoming timestamps (any order, may contain duplicates)
+
+    Returns:
+        (mask of incoming timestamps that are net-new, merged sorted unique timestamps).
+        Of several equal incoming timestamps only the first one is net-new
+    """
+    timestamps = np.asarray(timestamps, dtype=TIMESTAMP_DTYPE)
+    # 入力内の重複は最初の1件のみを対象にする
+    unique, first = np.unique(timestamps, return_index=True)
+    positions = np.searchsorted(known, unique)
+    if len(known):
+        found = (positions < len(known)) & (known[np.minimum(positions, len(known) - 1)] == unique)
+    else:
+        found = np.zeros(len(unique), dtype=bool)
+
+    new = ~found
+    mask = np.zeros(len(timestamps), dtype=bool)
+    mask[first[new]] = True
+    return mask, np.insert(known, positions[new], unique[new])
+
+
+class PriceMerger:
+    """
+    Per-series sets of timestamps already queued for writing, so overlapping
+    fetches and reruns only emit net-new price rows.
+
+    A series is a market for prices and a (market, token) pair for
+    token_prices. Each set is a sorted int64 array that every new batch is
+    inserted into (see merge_new). Series are serialized by a fixed pool of
+    striped locks. Call forget_market once a market's rows are committed to
+    bound memory.
+
+    Only rows seen by this merger are deduplicated. Points already in the
+    database from earlier runs are dropped by the price watermarks of
+    KnownKeys (see script_v1.queue_rows), not here.
+    """
+
+    def __init__(self, lock_stripes: int = LOCK_STRIPES):
+        self._known: Dict[Hashable, np.ndarray] = {}
+        # シリーズごとにロックを作らず固定数を使い回すため、forget_market後もロックが入れ替わらない
+        self._locks: List[threading.Lock] = [threading.Lock() for _ in range(lock_stripes)]
+
+    def _lock(self, series) -> threading.Lock:
+        return self._locks[hash(series) % len(self._locks)]
+
+    def merge(self, series, timestamps: np.ndarray) -> np.ndarray:
+        """
+        Records timestamps of a series and returns the mask of those not seen before.
+        """
+        with self._lock(series):
+            known = self._known.get(series, np.empty(0, dtype=TIMESTAMP_DTYPE))
+            mask, self._known[series] = merge_new(known, timestamps)
+        return mask
+
+    def filter_new(self, table: str, rows: List[dict]) -> List[dict]:
+        """
+        Drops price rows whose key was already seen, including duplicates within rows.
+
+        Args:
+            table: 'prices' or 'token_prices'
+            rows: Rows with the table's key columns
+
+        Returns:
+            Net-new rows, in their original order
+        """
+        series_columns = KEY_COLUMNS[table][:-1]
+        groups: Dict[Tuple[str, ...], List[int]] = {}
+        for i, row in enumerate(rows):
+            groups.setdefault(tuple(str(row[column]) for column in series_columns), []).append(i)
+
+        keep = np.zeros(len(rows), dtype=bool)
+        for series, indices in groups.items():
+            timestamps = np.fromiter((rows[i]["timestamp"] for i in indices), dtype=TIMESTAMP_DTYPE, count=len(indices))
+            mask = self.merge((table,) + series, timestamps)
+            keep[np.asarray(indices)[mask]] = True
+        return [rows[i] for i in np.flatnonzero(keep)]
+
+    def forget_market(self, market_id):
+        """Drops every series of a market (prices and token_prices)."""
+        market_id = str(market_id)
+        for key in [key for key in list(self._known) if key[1] == market_id]:
+            with self._lock(key):
+                self._known.pop(key, None)
@@ -0,0 +1,167 @@
+import os
+import json
+import threading
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+# gamma/output/prices
+DEFAULT_STORE_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "output", "prices")
+
+TIMESTAMP_DTYPE = np.dtype('<i8')
+TIMESTAMP_FILE = "timestamps.i8"
+PRICE_FILE = "prices.bin"
+META_FILE = "meta.json"
+
+
+class PriceStore:
+    """
+    Local columnar store for price history, partitioned by market.
+
+    Each market gets a directory holding two raw little-endian columns:
+    timestamps (int64) and prices (float64 or float32). Columns are
+    append-only and can be memory-mapped with NumPy without parsing.
+
+    Args:
+        root: Directory of the store
+        price_dtype: 'float64' or 'float32'. Fixed when the store is created
+    """
+
+    def __init__(self, root: str = DEFAULT_STORE_DIR, price_dtype: str = 'float64'):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+
+        meta_path = os.path.join(root, META_FILE)
+        if os.path.exists(meta_path):
+            with open(meta_path, 'r', encoding='utf-8') as f:
+                price_dtype = json.load(f)['price_dtype']
+        else:
+            with open(meta_path, 'w', encoding='utf-8') as f:
+                json.dump({'price_dtype': price_dtype}, f)
+        self.price_dtype = np.dtype(price_dtype).newbyteorder('<')
+
+        self._locks = {}
+        self._locks_lock = threading.Lock()
+
+    def _lock(self, market_id) -> threading.Lock:
+        with self._locks_lock:
+            return self._locks.setdefault(str(market_id), threading.Lock())
+
+    def _market_dir(self, market_id) -> str:
+        return os.path.join(self.root, str(market_id))
+
+    def append_arrays(self, market_id, timestamps: np.ndarray, prices: np.ndarray) -> int:
+        """
+        Appends points to a market's columns.
+
+        Returns:
+            Number of appended points
+        """
+        if len(timestamps) != len(prices):
+            raise ValueError("timestamps and prices must have the same length")
+        if len(timestamps) == 0:
+            return 0
+
+        timestamps = np.ascontiguousarray(timestamps, dtype=TIMESTAMP_DTYPE)
+        prices = np.ascontiguousarray(prices, dtype=self.price_dtype)
+        with self._lock(market_id):
+            self._append_locked(market_id, timestamps, prices)
+        return len(timestamps)
+
+    def _append_locked(self, market_id, timestamps: np.ndarray, prices: np.ndarray):
+        market_dir = self._market_dir(market_id)
+        os.makedirs(market_dir, exist_ok=True)
+        timestamp_path = os.path.join(market_dir, TIMESTAMP_FILE)
+        price_path = os.path.join(market_dir, PRICE_FILE)
+        # 前回の書き込みが2列の間で中断された場合は、追記前に共通の長さへ切り詰める
+        n = min(os.path.getsize(timestamp_path) // TIMESTAMP_DTYPE.itemsize if os.path.exists(timestamp_path) else 0,
+                os.path.getsize(price_path) // self.price_dtype.itemsize if os.path.exists(price_path) else 0)
+        for path, itemsize in ((timestamp_path, TIMESTAMP_DTYPE.itemsize), (price_path, self.price_dtype.itemsize)):
+            if os.path.exists(path) and os.path.getsize(path) != n * itemsize:
+                os.truncate(path, n * itemsize)
+        with open(timestamp_path, 'ab') as f:
+            timestamps.tofile(f)
+        with open(price_path, 'ab') as f:
+            prices.tofile(f)
+
+    def append(self, market_id, history: List[dict]) -> int:
+        """
+        Appends a /prices-history response (list of {"t": ..., "p": ...}) to a market.
+
+        Returns:
+            Number of appended points
+        """
+        n = len(history)
+        timestamps = np.fromiter((h['t'] for h in history), dtype=TIMESTAMP_DTYPE, count=n)
+        prices = np.fromiter((h['p'] for h in history), dtype=self.price_dtype, count=n)
+        return self.append_arrays(market_id, timestamps, prices)
+
+    def append_new(self, market_id, history: List[dict]) -> int:
+        """
+        Appends only the points newer than the last stored timestamp, so re-runs do not duplicate data.
+
+        Returns:
+            Number of appended points
+        """
+        # 重複の判定と追記を同じロック内で行い、同時に呼ばれても二重に追記しない
+        with self._lock(market_id):
+            last_ts = self.last_timestamp(market_id)
+            if last_ts is not None:
+                history = [h for h in history if h['t'] > last_ts]
+            if not history:
+                return 0
+            n = len(history)
+            timestamps = np.fromiter((h['t'] for h in history), dtype=TIMESTAMP_DTYPE, count=n)
+            prices = np.fromiter((h['p'] for h in history), dtype=self.price_dtype, count=n)
+            self._append_locked(market_id, timestamps, prices)
+        return n
+
+    def append_many(self, histories: Dict[str, List[dict]]) -> int:
+        """
+        Appends several markets at once.
+
+        Returns:
+            Total number of appended points
+        """
+        return sum(self.append(market_id, history) for market_id, history in histories.items())
+
+    def read(self, market_id, mmap: bool = True) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Returns (timestamps, prices) of a market. Empty arrays if the market is unknown.
+
+        Args:
+            market_id: Market ID
+            mmap: Memory-map the columns instead of reading them into memory
+        """
+        market_dir = self._market_dir(market_id)
+        columns = []
+        for name, dtype in ((TIMESTAMP_FILE, TIMESTAMP_DTYPE), (PRICE_FILE, self.price_dtype)):
+            path = os.path.join(market_dir, name)
+            if not os.path.exists(path) or os.path.getsize(path) < dtype.itemsize:
+                columns.append(np.empty(0, dtype=dtype))
+            elif mmap:
+                columns.append(np.memmap(path, dtype=dtype, mode='r'))
+            else:
+                columns.append(np.fromfile(path, dtype=dtype))
+        timestamps, prices = columns
+        # 書き込み途中で中断された場合は短い方に揃える
+        n = min(len(timestamps), len(prices))
+        return timestamps[:n], prices[:n]
+
+    def last_timestamp(self, market_id) -> Optional[int]:
+        """Returns the last appended timestamp of a market, or None if it has no points."""
+        timestamps, _ = self.read(market_id)
+        return int(timestamps[-1]) if len(timestamps) else None
+
+    def markets(self) -> List[str]:
+        """Returns the IDs of all markets in the store."""
+        return sorted(name for name in os.listdir(self.root)
+                      if os.path.isdir(os.path.join(self.root, name)))
+
+    def iter_markets(self, market_ids: Optional[Iterable[str]] = None):
+        """
+        Yields (market_id, timestamps, prices) for the given markets (default: all).
+        """
+        for market_id in (market_ids if market_ids is not None else self.markets()):
+            timestamps, prices = self.read(market_id)
+            yield market_id, timestamps, prices
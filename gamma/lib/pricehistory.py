@@ -1,20 +1,76 @@
+import os
+import json
 import requests
-from typing import Optional, Union
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple, Union
 from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
 import time
+from gamma.lib.http_session import get_session, DEFAULT_TIMEOUT
+from gamma.lib.pricehistory_cache import PriceHistoryCache, default_cache
+from gamma.lib.resolution_planner import default_planner
+from gamma.lib.negative_cache import default_negative_cache, EMPTY_HISTORY, MISSING_FIELDS, INACTIVE
+from gamma.lib.metrics import PRICEHISTORY_REQUESTS, PRICEHISTORY_RETRIES, PRICEHISTORY_LATENCY, PRICEHISTORY_SKIPPED
+
+# 確定済みとみなすまでの猶予 (秒)。これより古いウィンドウはキャッシュを無期限にする
+SETTLED_AFTER = 3600
+
+# 1マーケットの全アウトカムのトークンを同時に取得する数
+PRICEHISTORY_TOKEN_WORKERS = int(os.getenv("PRICEHISTORY_TOKEN_WORKERS", "8"))
+
+# クローズ済みマーケットの履歴を分割取得するウィンドウ幅 (日)。0の場合は一括取得
+PRICEHISTORY_WINDOW_DAYS = int(os.getenv("PRICEHISTORY_WINDOW_DAYS", "30"))
+PRICEHISTORY_WINDOW_WORKERS = int(os.getenv("PRICEHISTORY_WINDOW_WORKERS", "4"))
+
+
+class PriceHistoryError(Exception):
+    """Raised when /prices-history still returns an error response after the fetcher's retries."""
+
+
+def _checked(res: dict) -> dict:
+    # フェッチャーのリトライ後もエラーの場合は「履歴なし」と区別して例外にする
+    if 'error' in res or res.get('history') is None:
+        raise PriceHistoryError(res.get('error', 'Response has no history'))
+    return res
+
+
+def merge_histories(histories: Iterable[List[dict]]) -> List[dict]:
+    """
+    Merges price histories into a single series sorted by timestamp.
+
+    Points with the same timestamp are deduplicated (the later history wins).
+    """
+    merged = {}
+    for history in histories:
+        for point in history or []:
+            merged[point['t']] = point
+    return [merged[t] for t in sorted(merged)]
+
 
 class PriceHistoryFetcher:
-    def __init__(self, base_url: str, retry_wait: int = 5, max_retries: int = 10):
+    def __init__(self, base_url: str, retry_wait: int = 5, max_retries: int = 10,
+                 session: Optional[requests.Session] = None, timeout: float = DEFAULT_TIMEOUT,
+                 max_retry_wait: int = 30, cache: Optional[PriceHistoryCache] = None):
         self.base_url = base_url
         self.retry_wait = retry_wait  # 初期リトライ待機秒数
         self.max_retries = max_retries  # 最大リトライ回数
+        # 全体のスロットリングは共有セッションのレートリミッターが担うため、個別の待機は上限を設ける
+        self.max_retry_wait = max_retry_wait
+        self._session = session
+        self.timeout = timeout
+        self.cache = cache  # Noneの場合はキャッシュしない
+
+    @property
+    def session(self) -> requests.Session:
+        # 未指定の場合はスレッド間で共有する接続プールを使う
+        return self._session if self._session is not None else get_session()
 
     def fetch_pricehistory(self,
                           market: str,
                           start_ts: Optional[int] = None,
                           end_ts: Optional[int] = None,
                           interval: Optional[str] = None,
-                          fidelity: Optional[int] = None) -> dict:
+                          fidelity: Optional[int] = None,
+                          immutable: bool = False) -> dict:
         """
         Fetches price history data.
         
@@ -24,6 +80,7 @@ class PriceHistoryFetcher:
             end_ts: End time (UTC UNIX timestamp)
             interval: Duration ('1m', '1w', '1d', '6h', '1h', 'max')
             fidelity: Data resolution (in minutes)
+            immutable: The history can no longer change (closed market), so the cached response never expires
         """
         params = {'market': market}
         
@@ -49,31 +106,389 @@ class PriceHistoryFetcher:
 
         url = f"{self.base_url}/prices-history"
 
+        if self.cache is not None:
+            cached = self.cache.get(market, start_ts, end_ts, interval, fidelity)
+            if cached is not None:
+                PRICEHISTORY_REQUESTS.inc(outcome="cached")
+                return cached
+
         for attempt in range(self.max_retries):
-            response = requests.get(url, params=params)
+            if attempt > 0:
+                PRICEHISTORY_RETRIES.inc()
+            with PRICEHISTORY_LATENCY.time():
+                response = self.session.get(url, params=params, timeout=self.timeout)
             
             if response.status_code != 200:
                 if attempt == self.max_retries - 1:  # 最後の試行でエラーの場合のみ表示
                     print(f"{RED}HTTP Error: Status code {response.status_code}{RESET}")
                     print(f"{RED}Failed after all retry attempts{RESET}")
+                    PRICEHISTORY_REQUESTS.inc(outcome="error")
                     return {"error": f"HTTP error {response.status_code}"}
                 # 指数関数的バックオフ: 待機時間を2倍ずつ増やす
-                wait_time = self.retry_wait * (2 ** attempt)
+                wait_time = min(self.retry_wait * (2 ** attempt), self.max_retry_wait)
                 time.sleep(wait_time)
                 continue
 
             try:
                 data = response.json()
+                if self.cache is not None and isinstance(data, dict) and 'error' not in data:
+                    self.cache.put(data, market, start_ts, end_ts, interval, fidelity, immutable=immutable)
+                PRICEHISTORY_REQUESTS.inc(outcome="ok")
                 return data
             except requests.exceptions.JSONDecodeError as e:
                 if attempt == self.max_retries - 1:  # 最後の試行でエラーの場合のみ表示
                     print(f"{RED}JSON Decode Error: {e}{RESET}")
                     print(response.text)
                     print(f"{RED}Failed after all retry attempts{RESET}")
+                    PRICEHISTORY_REQUESTS.inc(outcome="error")
                     return {"error": "Retry limit exceeded"}
                 # 指数関数的バックオフ: 待機時間を2倍ずつ増やす
-                wait_time = self.retry_wait * (2 ** attempt)
+                wait_time = min(self.retry_wait * (2 ** attempt), self.max_retry_wait)
                 time.sleep(wait_time)
                 continue
 
         return {"error": "Retry limit exceeded"}
+
+    def fetch_pricehistory_windowed(self,
+                                    market: str,
+                                    start_ts: int,
+                                    end_ts: Optional[int] = None,
+                                    horizon_ts: Optional[int] = None,
+                                    window_seconds: int = 30 * 24 * 3600,
+                                    fidelity: Optional[int] = None,
+                                    max_workers: int = 4,
+                                    immutable: bool = False) -> dict:
+        """
+        Fetches price history split into time windows fetched concurrently.
+
+        [start_ts, end_ts] is split into windows of window_seconds. If end_ts is
+        None, windows are laid out up to horizon_ts (default: now) and the last
+        window is left open-ended, so no points after the horizon are lost.
+        Window boundaries are aligned to start_ts, which keeps cache keys of
+        past windows stable across runs.
+
+        Args:
+            market: CLOB token ID
+            start_ts: Start time (UTC UNIX timestamp)
+            end_ts: End time (UTC UNIX timestamp). None = up to the latest point
+            horizon_ts: Where to stop laying out windows when end_ts is None
+            window_seconds: Length of each window in seconds
+            fidelity: Data resolution (in minutes)
+            max_workers: Maximum number of windows fetched concurrently
+            immutable: The whole history can no longer change (closed market)
+
+        Returns:
+            {"history": [...]} sorted by timestamp without duplicates, or the first error response
+        """
+        now = int(time.time())
+        if horizon_ts is None:
+            horizon_ts = end_ts if end_ts is not None else now
+
+        windows = []
+        window_start = start_ts
+        while window_start + window_seconds < horizon_ts:
+            windows.append((window_start, window_start + window_seconds))
+            window_start += window_seconds
+        windows.append((window_start, end_ts))
+
+        def fetch_window(window):
+            window_start, window_end = window
+            # 十分過去に終わったウィンドウはオープン中のマーケットでも変化しない
+            settled = window_end is not None and window_end < now - SETTLED_AFTER
+            return self.fetch_pricehistory(market=market, start_ts=window_start, end_ts=window_end,
+                                           fidelity=fidelity, immutable=immutable or settled)
+
+        if len(windows) == 1:
+            return fetch_window(windows[0])
+
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(windows))) as executor:
+            results = list(executor.map(fetch_window, windows))
+
+        for res in results:
+            if 'error' in res:
+                return res
+        return {"history": merge_histories(res.get('history') for res in results)}
+
+
+# 全マーケットで共有するフェッチャー (接続プールとディスクキャッシュを使い回す)
+PRICEHISTORY_FETCHER = PriceHistoryFetcher("https://clob.polymarket.com", cache=default_cache())
+
+# オープン中のマーケットのinterval/fidelityを決める (実行間で記憶する)
+RESOLUTION_PLANNER = default_planner()
+
+# 取得しても履歴が無いと分かっているマーケット (実行間で記憶し、リクエストを送らない)
+NEGATIVE_CACHE = default_negative_cache()
+
+
+def fetch_concurrently(fetch_fn: Callable[[Any], Any], keys: Iterable, max_workers: int = 8) -> Tuple[Dict[Any, Any], Dict[Any, Exception]]:
+    """
+    Calls fetch_fn(key) for every key concurrently (e.g. every outcome token of a market or event).
+
+    The wall time is about that of the slowest key. A failing key does not
+    affect the others.
+
+    Returns:
+        ({key: result}, {key: exception}) for the keys that succeeded / failed
+    """
+    keys = list(dict.fromkeys(keys))
+    results, errors = {}, {}
+    if not keys:
+        return results, errors
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(keys))) as executor:
+        futures = {key: executor.submit(fetch_fn, key) for key in keys}
+        for key, future in futures.items():
+            try:
+                results[key] = future.result()
+            except Exception as e:
+                errors[key] = e
+    return results, errors
+
+
+def parse_token_ids(clob_token_ids) -> List[str]:
+    """clobTokenIds (JSON文字列またはリスト) を全アウトカムのトークンIDのリストにする。"""
+    return json.loads(clob_token_ids) if isinstance(clob_token_ids, str) else list(clob_token_ids)
+
+
+def fetch_delta(fetcher: PriceHistoryFetcher, token_id: str, since_ts: int, fidelity: Optional[int] = None,
+                window_seconds: int = 0, max_workers: int = 4) -> dict:
+    """
+    Fetches only the points after since_ts (the latest stored timestamp of an open market).
+
+    Args:
+        fetcher: PriceHistoryFetcher
+        token_id: CLOB token ID
+        since_ts: Latest stored timestamp
+        fidelity: Data resolution (in minutes)
+        window_seconds: Split the range into windows of this length (0 = one request)
+        max_workers: Maximum number of windows fetched concurrently
+
+    Returns:
+        {"history": [...]} with points newer than since_ts (empty if there is nothing new)
+
+    Raises:
+        PriceHistoryError: The CLOB returned an error response, so the caller retries
+            instead of reading it as "nothing new"
+    """
+    if window_seconds > 0:
+        res = fetcher.fetch_pricehistory_windowed(market=token_id, start_ts=since_ts + 1, window_seconds=window_seconds,
+                                                  fidelity=fidelity, max_workers=max_workers)
+    else:
+        res = fetcher.fetch_pricehistory(market=token_id, start_ts=since_ts + 1, fidelity=fidelity)
+    res = _checked(res)
+    # startTsちょうどの点が返る場合があるため、保存済みの時刻以前は除く
+    return {'history': [h for h in res['history'] if h['t'] > since_ts]}
+
+
+def fetch_market_token_histories(fetch_fn: Callable[..., Optional[dict]], market: dict, token_ids: Iterable[str], logger,
+                                 since_ts: Optional[Callable[[str], Optional[int]]] = None,
+                                 max_workers: int = PRICEHISTORY_TOKEN_WORKERS) -> Dict[str, Optional[dict]]:
+    """
+    Fetches the price history of every outcome token of a market concurrently
+    over the shared connection pool.
+
+    Args:
+        fetch_fn: Called as fetch_fn(market, token_id, logger, since_ts=...) (fetch_pricehistory of the caller)
+        market: Market data
+        token_ids: CLOB token IDs of every outcome
+        logger: Logger
+        since_ts: since_ts(token_id) returns the latest stored timestamp, so open markets only fetch the delta
+        max_workers: Maximum number of tokens fetched concurrently
+
+    Returns:
+        {token_id: price_data}
+
+    Raises:
+        The error of the first failed token, after logging every failed token,
+        so the market is retried as a whole instead of being stored without prices
+    """
+    def fetch_token(token_id):
+        return fetch_fn(market, token_id, logger, since_ts=since_ts(token_id) if since_ts is not None else None)
+
+    results, errors = fetch_concurrently(fetch_token, token_ids, max_workers)
+    for token_id, e in errors.items():
+        logger.error(f"Market ID: {market['id']} - Token {token_id} failed: {str(e)}")
+    if errors:
+        raise next(iter(errors.values()))
+    return results
+
+
+
+def to_unix(date_str):
+    """Converts a Gamma API date string (e.g. 2024-12-08T17:47:39.583Z) to a UNIX timestamp."""
+    try:
+        return int(datetime.strptime(date_str, '%Y-%m-%dT%H:%M:%S.%fZ').strftime('%s'))
+    except ValueError:
+        return int(datetime.strptime(date_str, '%Y-%m-%dT%H:%M:%SZ').strftime('%s'))
+
+
+def validate_market_fields(market, logger):
+    """
+    Validate required fields in market data
+
+    Args:
+        market (dict): Market data to validate
+        logger: Logger instance
+
+    Returns:
+        bool: True if all fields are valid
+    """
+    required_fields = ['clobTokenIds', 'startDate', 'endDate']
+
+    for field in required_fields:
+        if field not in market or market[field] is None:
+            logger.error(f"[Marketid]:{market['id']} - Error: Missing {field} field")
+            return False
+
+    return True
+
+
+def remember_negative(market, reason, clobTokenIds=None):
+    """履歴を取得できなかった理由をネガティブキャッシュに記録する (clobTokenIdsを省略するとマーケット全体)。"""
+    if NEGATIVE_CACHE is not None:
+        NEGATIVE_CACHE.add(market['id'], reason, token_id=clobTokenIds, updated_at=market.get('updatedAt'))
+
+
+def skip_market(market, logger, clobTokenIds=None) -> bool:
+    """
+    Checks whether a market (or one of its tokens) has nothing to fetch.
+
+    Markets in the negative cache are skipped without a request. Inactive
+    or archived markets and markets missing required fields are recorded
+    in the negative cache and skipped.
+
+    Returns:
+        True if the market must not be fetched
+    """
+    if NEGATIVE_CACHE is not None:
+        reason = NEGATIVE_CACHE.get(market['id'], clobTokenIds, market.get('updatedAt'))
+        if reason is not None:
+            PRICEHISTORY_SKIPPED.inc(reason=reason)
+            return True
+    if not (market.get('active') == True and market.get('archived') == False):
+        remember_negative(market, INACTIVE)
+        logger.error(f"Market ID: {market['id']} - Market is not active or archived")
+        return True
+    if not validate_market_fields(market, logger):
+        remember_negative(market, MISSING_FIELDS)
+        return True
+    return False
+
+
+def fetch_closed_market_pricehistory(market, clobTokenIds, fetcher: PriceHistoryFetcher = PRICEHISTORY_FETCHER) -> Optional[dict]:
+    """
+    Fetches the whole history of a closed market's token (windowed if PRICEHISTORY_WINDOW_DAYS > 0).
+
+    An empty history is recorded in the negative cache, since a closed market never gets new points.
+
+    Returns:
+        {"history": [...]}, or None if the history is empty
+
+    Raises:
+        PriceHistoryError: The CLOB returned an error response
+    """
+    start_unix = to_unix(market['startDate'])
+
+    # クローズ済みマーケットの履歴は変化しないため、キャッシュを無期限にする
+    if PRICEHISTORY_WINDOW_DAYS > 0:
+        try:
+            horizon_unix = to_unix(market['endDate'])
+        except (KeyError, TypeError, ValueError):
+            horizon_unix = None
+        # 最後のウィンドウは終端を指定しないため、endDate以降の履歴も取りこぼさない
+        res = fetcher.fetch_pricehistory_windowed(
+            market=clobTokenIds,
+            start_ts=start_unix,
+            horizon_ts=horizon_unix,
+            window_seconds=PRICEHISTORY_WINDOW_DAYS * 24 * 3600,
+            max_workers=PRICEHISTORY_WINDOW_WORKERS,
+            immutable=True
+        )
+    else:
+        res = fetcher.fetch_pricehistory(market=clobTokenIds, start_ts=start_unix, immutable=True)
+    res = _checked(res)
+    if len(res['history']) > 0:
+        return res
+    # クローズ済みマーケットの履歴は増えないため、次回以降は取得しない
+    remember_negative(market, EMPTY_HISTORY, clobTokenIds)
+    return None
+
+
+def fetch_open_market_pricehistory(market, clobTokenIds, since_ts=None,
+                                   fetcher: PriceHistoryFetcher = PRICEHISTORY_FETCHER) -> Optional[dict]:
+    """
+    Fetches an open market's token with the interval/fidelity planned by
+    RESOLUTION_PLANNER (one request once the token's fidelity is remembered),
+    or only the points after since_ts if given.
+
+    Returns:
+        {"history": [...]} (may be empty)
+
+    Raises:
+        PriceHistoryError: The CLOB returned an error response
+    """
+    start_unix = to_unix(market['startDate'])
+
+    # 経過時間と前回の結果からinterval/fidelityを決定する (トークンごとに記憶する)
+    interval, fidelity = RESOLUTION_PLANNER.plan(clobTokenIds, start_unix)
+
+    # 保存済みの履歴がある場合は差分のみ取得する (同じ解像度で取得し、プランナーには記録しない)
+    if since_ts is not None:
+        return fetch_delta(fetcher, clobTokenIds, since_ts, fidelity,
+                           window_seconds=PRICEHISTORY_WINDOW_DAYS * 24 * 3600,
+                           max_workers=PRICEHISTORY_WINDOW_WORKERS)
+
+    # 記憶が無い場合のみ候補のfidelityを比較し、点数の多い方を使う (以降は1リクエスト)
+    best_fidelity, best = None, None
+    for candidate in RESOLUTION_PLANNER.comparison(clobTokenIds, interval) or (fidelity,):
+        res = _checked(fetcher.fetch_pricehistory(
+            market=clobTokenIds,
+            interval=interval,
+            fidelity=candidate
+        ))
+        if best is None or len(res['history']) > len(best['history']):
+            best_fidelity, best = candidate, res
+    RESOLUTION_PLANNER.record(clobTokenIds, interval, best_fidelity, len(best['history']))
+    return best
+
+
+def fetch_token_pricehistory(market, clobTokenIds, logger, max_retries=3, retry_delay=5, since_ts=None,
+                             on_closed: Optional[Callable[[dict, Optional[dict]], None]] = None) -> Optional[dict]:
+    """
+    Fetches the price history of one outcome token, retrying failed attempts.
+
+    Args:
+        market: Market data
+        clobTokenIds: CLOB token ID
+        logger: Logger
+        max_retries: Maximum number of attempts
+        retry_delay: Seconds between attempts
+        since_ts: Latest stored timestamp of an open market; only newer points are fetched
+        on_closed: Called as on_closed(market, res) after a closed market was fetched (res is None if empty)
+
+    Returns:
+        {"history": [...]}, or None if there is nothing to fetch
+
+    Raises:
+        The error of the last attempt
+    """
+    if skip_market(market, logger, clobTokenIds):
+        return None
+
+    for attempt in range(max_retries):
+        try:
+            if market['closed'] == True:
+                res = fetch_closed_market_pricehistory(market, clobTokenIds)
+                if on_closed is not None:
+                    on_closed(market, res)
+                return res
+            elif market['closed'] == False:
+                return fetch_open_market_pricehistory(market, clobTokenIds, since_ts=since_ts)
+            return None
+
+        except Exception as e:
+            if attempt == max_retries - 1:  # 最後の試行の場合
+                logger.error(f"Market ID: {market['id']} - Failed after {max_retries} attempts: {str(e)}")
+                raise  # 最後の試行で失敗した場合は例外を再度発生させる
+            else:
+                logger.warning(f"Market ID: {market['id']} - Attempt {attempt + 1} failed: {str(e)}. Retrying in {retry_delay} seconds...")
+                time.sleep(retry_delay)  # 次の試行までの待機
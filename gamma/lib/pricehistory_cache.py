@@ -0,0 +1,173 @@
+import os
+import json
+import time
+import hashlib
+import threading
+from typing import Optional
+
+# gamma/output/cache/pricehistory
+DEFAULT_CACHE_DIR = os.getenv(
+    "PRICEHISTORY_CACHE_DIR",
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "output", "cache", "pricehistory"))
+DEFAULT_TTL = int(os.getenv("PRICEHISTORY_CACHE_TTL", "3600"))
+DEFAULT_MAX_BYTES = int(os.getenv("PRICEHISTORY_CACHE_MAX_BYTES", "0")) or None
+
+
+class PriceHistoryCache:
+    """
+    Content-addressed on-disk cache for /prices-history responses.
+
+    Entries are keyed by (market, startTs, endTs, interval, fidelity).
+    Immutable entries (closed markets) never expire; other entries expire
+    after `ttl` seconds. When `max_bytes` is set, the least recently used
+    entries are evicted once the cache grows past it.
+
+    Args:
+        cache_dir: Directory to store entries in
+        ttl: Lifetime of mutable entries in seconds
+        max_bytes: Maximum total size of the cache in bytes (None = unbounded)
+    """
+
+    def __init__(self, cache_dir: str = DEFAULT_CACHE_DIR, ttl: int = DEFAULT_TTL, max_bytes: Optional[int] = DEFAULT_MAX_BYTES):
+        self.cache_dir = cache_dir
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self._total_bytes = None
+        self._lock = threading.Lock()
+        self._evict_lock = threading.Lock()
+        os.makedirs(cache_dir, exist_ok=True)
+
+    @staticmethod
+    def make_key(market: str,
+                 start_ts: Optional[int] = None,
+                 end_ts: Optional[int] = None,
+                 interval: Optional[str] = None,
+                 fidelity: Optional[int] = None) -> str:
+        raw = json.dumps([str(market), start_ts, end_ts, interval, fidelity], separators=(',', ':'))
+        return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key[:2], f"{key}.json")
+
+    def get(self, market: str,
+            start_ts: Optional[int] = None,
+            end_ts: Optional[int] = None,
+            interval: Optional[str] = None,
+            fidelity: Optional[int] = None) -> Optional[dict]:
+        """
+        Returns the cached response, or None on a miss or an expired entry.
+        """
+        path = self._path(self.make_key(market, start_ts, end_ts, interval, fidelity))
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            with self._lock:
+                self.misses += 1
+            return None
+
+        if not entry.get("immutable") and time.time() - entry.get("stored_at", 0) > self.ttl:
+            with self._lock:
+                self.misses += 1
+            return None
+
+        try:
+            # LRU判定用に最終アクセス時刻を更新
+            os.utime(path)
+        except OSError:
+            pass
+        with self._lock:
+            self.hits += 1
+        return entry["data"]
+
+    def put(self, data: dict,
+            market: str,
+            start_ts: Optional[int] = None,
+            end_ts: Optional[int] = None,
+            interval: Optional[str] = None,
+            fidelity: Optional[int] = None,
+            immutable: bool = False):
+        """
+        Stores a response. Immutable entries are never expired by TTL.
+        """
+        key = self.make_key(market, start_ts, end_ts, interval, fidelity)
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        payload = json.dumps({"immutable": immutable, "stored_at": time.time(), "data": data},
+                             separators=(',', ':'))
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(payload)
+        os.replace(tmp_path, path)
+
+        with self._lock:
+            self.writes += 1
+            if self._total_bytes is not None:
+                self._total_bytes += len(payload)
+        if self.max_bytes is not None:
+            if self._total_bytes is None or self._total_bytes > self.max_bytes:
+                # 他スレッドが削除中であれば任せる
+                if self._evict_lock.acquire(blocking=False):
+                    try:
+                        self.evict()
+                    finally:
+                        self._evict_lock.release()
+
+    def _entries(self):
+        for root, _, files in os.walk(self.cache_dir):
+            for name in files:
+                if name.endswith('.json'):
+                    path = os.path.join(root, name)
+                    try:
+                        st = os.stat(path)
+                    except OSError:
+                        continue
+                    yield path, st.st_size, st.st_mtime
+
+    def evict(self, max_bytes: Optional[int] = None) -> int:
+        """
+        Removes least recently used entries until the cache fits in max_bytes.
+
+        Returns:
+            Number of removed entries
+        """
+        if max_bytes is None:
+            max_bytes = self.max_bytes
+        entries = list(self._entries())
+        total = sum(size for _, size, _ in entries)
+        removed = 0
+        if max_bytes is not None and total > max_bytes:
+            # 古い順に削除し、上限の9割まで減らす
+            target = int(max_bytes * 0.9)
+            for path, size, _ in sorted(entries, key=lambda e: e[2]):
+                if total <= target:
+                    break
+                try:
+                    os.remove(path)
+                except OSError:
+                    continue
+                total -= size
+                removed += 1
+        with self._lock:
+            self._total_bytes = total
+        return removed
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "writes": self.writes,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
+
+
+def default_cache() -> Optional[PriceHistoryCache]:
+    """Returns a cache using the environment settings, or None if PRICEHISTORY_CACHE=0."""
+    if os.getenv("PRICEHISTORY_CACHE", "1") == "0":
+        return None
+    return PriceHistoryCache()
@@ -0,0 +1,177 @@
+import os
+import time
+import threading
+from contextlib import contextmanager
+from typing import Dict, Optional
+
+# スロットリングとみなすHTTPステータス
+THROTTLE_STATUS = {429, 500, 502, 503, 504}
+
+
+class AdaptiveRateLimiter:
+    """
+    Token-bucket rate limiter with AIMD-adjusted rate and concurrency.
+
+    Healthy responses raise the request rate and the number of requests in
+    flight additively, but only while that limit is the bottleneck (the
+    token bucket is empty / every concurrency slot is in use), so an idle
+    client does not drift up to the maximums; 429/5xx responses and connection errors cut both
+    multiplicatively (at most once per cooldown window, so a burst of
+    in-flight failures counts as a single congestion signal).
+
+    Args:
+        rate: Initial requests per second
+        min_rate: Lower bound for the request rate
+        max_rate: Upper bound for the request rate
+        concurrency: Initial number of requests allowed in flight
+        min_concurrency: Lower bound for concurrency
+        max_concurrency: Upper bound for concurrency
+        increase_step: Additive increase applied per `rate` healthy responses
+        decrease_factor: Multiplicative decrease applied on throttling
+        cooldown: Minimum seconds between two decreases
+    """
+
+    def __init__(self,
+                 rate: float = 10.0,
+                 min_rate: float = 0.5,
+                 max_rate: float = 200.0,
+                 concurrency: float = 16,
+                 min_concurrency: float = 1,
+                 max_concurrency: float = 256,
+                 increase_step: float = 1.0,
+                 decrease_factor: float = 0.5,
+                 cooldown: float = 2.0):
+        self.rate = rate
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.concurrency = concurrency
+        self.min_concurrency = min_concurrency
+        self.max_concurrency = max_concurrency
+        self.increase_step = increase_step
+        self.decrease_factor = decrease_factor
+        self.cooldown = cooldown
+
+        self._tokens = 1.0
+        self._last_refill = time.monotonic()
+        self._last_decrease = 0.0
+        self._paused_until = 0.0
+        self._in_flight = 0
+        self._lock = threading.Lock()
+        self._slot_available = threading.Condition(self._lock)
+
+    def _refill(self, now: float):
+        # バーストは1秒分まで
+        self._tokens = min(max(self.rate, 1.0), self._tokens + (now - self._last_refill) * self.rate)
+        self._last_refill = now
+
+    def acquire(self):
+        """Blocks until a concurrency slot and a rate token are available."""
+        with self._slot_available:
+            while self._in_flight >= int(self.concurrency):
+                self._slot_available.wait()
+            self._in_flight += 1
+
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._refill(now)
+                if now >= self._paused_until and self._tokens >= 1.0:
+                    self._tokens -= 1.0
+                    return
+                wait = max(self._paused_until - now, (1.0 - self._tokens) / self.rate)
+            time.sleep(wait)
+
+    def release(self, status_code: Optional[int] = None, retry_after: Optional[float] = None):
+        """
+        Releases a slot and feeds the outcome back into the AIMD controller.
+
+        Args:
+            status_code: HTTP status of the response, or None if the request failed at the connection level
+            retry_after: Value of the Retry-After header in seconds, if any
+        """
+        with self._slot_available:
+            # 上限まで使っている場合のみ増やす (アイドル時に上限が膨らみ、次のバーストで超過しないように)
+            saturated = self._in_flight >= int(self.concurrency)
+            self._in_flight -= 1
+            if status_code is None or status_code in THROTTLE_STATUS:
+                self._decrease(retry_after)
+            else:
+                self._increase(saturated)
+            self._slot_available.notify_all()
+
+    def _increase(self, saturated: bool):
+        # 加算的増加: 1秒分のレスポンスが全て正常ならおよそ increase_step 増える
+        self._refill(time.monotonic())
+        if self._tokens < 1.0:
+            # トークンを使い切っている (レートが律速している) 場合のみレートを上げる
+            self.rate = min(self.max_rate, self.rate + self.increase_step / max(self.rate, 1.0))
+        if saturated:
+            self.concurrency = min(self.max_concurrency,
+                                   self.concurrency + self.increase_step / max(self.concurrency, 1.0))
+
+    def _decrease(self, retry_after: Optional[float]):
+        now = time.monotonic()
+        if retry_after:
+            self._paused_until = max(self._paused_until, now + retry_after)
+        if now - self._last_decrease < self.cooldown:
+            return
+        self._last_decrease = now
+        # 乗算的減少
+        self.rate = max(self.min_rate, self.rate * self.decrease_factor)
+        self.concurrency = max(self.min_concurrency, self.concurrency * self.decrease_factor)
+        self._tokens = min(self._tokens, 1.0)
+
+    @contextmanager
+    def limit(self):
+        """
+        Context manager around one request. Call the yielded function with the response status.
+
+        Example:
+            with limiter.limit() as record:
+                response = session.get(url)
+                record(response.status_code)
+        """
+        outcome = {"status_code": None, "retry_after": None}
+
+        def record(status_code: Optional[int], retry_after: Optional[float] = None):
+            outcome["status_code"] = status_code
+            outcome["retry_after"] = retry_after
+
+        self.acquire()
+        try:
+            yield record
+        finally:
+            self.release(outcome["status_code"], outcome["retry_after"])
+
+
+# ホストごとの初期レート (req/s)。AIMDでAPIが許容する上限まで自動調整される
+HOST_RATE_LIMITS = {
+    "gamma-api.polymarket.com": float(os.getenv("GAMMA_RATE_LIMIT", "5")),
+    "clob.polymarket.com": float(os.getenv("CLOB_RATE_LIMIT", "20")),
+}
+DEFAULT_RATE_LIMIT = float(os.getenv("HTTP_RATE_LIMIT", "10"))
+
+_limiters: Dict[str, AdaptiveRateLimiter] = {}
+_limiters_lock = threading.Lock()
+
+
+def get_limiter(host: str) -> AdaptiveRateLimiter:
+    """Returns the process-wide limiter for a host, creating it on first use."""
+    limiter = _limiters.get(host)
+    if limiter is None:
+        with _limiters_lock:
+            limiter = _limiters.get(host)
+            if limiter is None:
+                limiter = AdaptiveRateLimiter(rate=HOST_RATE_LIMITS.get(host, DEFAULT_RATE_LIMIT))
+                _limiters[host] = limiter
+    return limiter
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """Parses a Retry-After header given in seconds (HTTP-date values are ignored)."""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        return None
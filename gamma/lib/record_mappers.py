@@ -0,0 +1,238 @@
+import json
+from typing import Any, Callable, Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+# 親レコードのID (markets/tagsのevent_id、pricesのmarket_id) を表す
+PARENT_ID = object()
+
+
+class Context(NamedTuple):
+    """Value passed to the builder in its context dict (e.g. the token id of a price series)."""
+    key: str
+
+
+def parse_json(value):
+    """Decodes JSON-encoded strings (e.g. '["Yes", "No"]'); other values are kept as is."""
+    return json.loads(value) if isinstance(value, str) else value
+
+
+class Column(NamedTuple):
+    """
+    One column of a table and where its value comes from.
+
+    Args:
+        name: Column name in the database (snake_case)
+        source: Key in the API record (camelCase), PARENT_ID or Context(key)
+        converter: Applied to the source value, if given
+        required: Read with record[source] (KeyError if missing) instead of .get()
+    """
+    name: str
+    source: Any
+    converter: Optional[Callable[[Any], Any]] = None
+    required: bool = False
+
+
+class RecordMapper:
+    """
+    Row builder for a table, compiled once from a list of Columns.
+
+    The column mapping is turned into Python source for a single function
+    (one dict/tuple display with inlined .get() calls), so building a row
+    costs no per-column loop or lookup of the mapping.
+
+    Args:
+        table: Table name
+        columns: Column definitions in table order
+    """
+
+    def __init__(self, table: str, columns: List[Column]):
+        self.table = table
+        self.columns: Tuple[str, ...] = tuple(column.name for column in columns)
+        self.definitions = list(columns)
+        self.to_dict = self._compile("dict")
+        self.to_tuple = self._compile("tuple")
+
+    def _compile(self, kind: str) -> Callable[..., Any]:
+        namespace: Dict[str, Any] = {}
+        values = []
+        for i, column in enumerate(self.definitions):
+            if column.source is PARENT_ID:
+                expr = "parent_id"
+            elif isinstance(column.source, Context):
+                expr = f"context[{column.source.key!r}]"
+            elif column.required:
+                expr = f"record[{column.source!r}]"
+            else:
+                expr = f"get({column.source!r})"
+            if column.converter is not None:
+                namespace[f"_convert{i}"] = column.converter
+                expr = f"_convert{i}({expr})"
+            values.append(f"{column.name!r}: {expr}" if kind == "dict" else expr)
+
+        if kind == "dict":
+            body = "{\n        " + ",\n        ".join(values) + "\n    }"
+        else:
+            body = "(\n        " + ",\n        ".join(values) + ",\n    )"
+        source = (f"def build_{self.table}_{kind}(record, parent_id=None, context=None):\n"
+                  f"    get = record.get\n"
+                  f"    return {body}\n")
+        exec(compile(source, f"<record_mapper {self.table}>", "exec"), namespace)
+        function = namespace[f"build_{self.table}_{kind}"]
+        function.__source__ = source
+        return function
+
+    def dicts(self, records: Iterable[dict], parent_id=None, context: Optional[dict] = None) -> List[dict]:
+        """Builds dict rows (for PostgREST) from API records."""
+        to_dict = self.to_dict
+        return [to_dict(record, parent_id, context) for record in records]
+
+    def tuples(self, records: Iterable[dict], parent_id=None, context: Optional[dict] = None) -> List[tuple]:
+        """Builds tuple rows in column order (for COPY) from API records."""
+        to_tuple = self.to_tuple
+        return [to_tuple(record, parent_id, context) for record in records]
+
+
+EVENTS = RecordMapper("events", [
+    Column("id", "id", required=True),
+    Column("ticker", "ticker"),
+    Column("slug", "slug"),
+    Column("title", "title"),
+    Column("description", "description"),
+    Column("resolution_source", "resolutionSource"),
+    Column("start_date", "startDate"),
+    Column("creation_date", "creationDate"),
+    Column("end_date", "endDate"),
+    Column("image", "image"),
+    Column("icon", "icon"),
+    Column("active", "active"),
+    Column("closed", "closed"),
+    Column("archived", "archived"),
+    Column("new", "new"),
+    Column("featured", "featured"),
+    Column("restricted", "restricted"),
+    Column("liquidity", "liquidity"),
+    Column("volume", "volume"),
+    Column("open_interest", "openInterest"),
+    Column("sort_by", "sortBy"),
+    Column("created_at", "createdAt"),
+    Column("updated_at", "updatedAt"),
+    Column("competitive", "competitive"),
+    Column("volume_24hr", "volume24hr"),
+    Column("enable_order_book", "enableOrderBook"),
+    Column("liquidity_clob", "liquidityClob"),
+    Column("_sync", "_sync"),
+    Column("neg_risk", "negRisk"),
+    Column("neg_risk_market_id", "negRiskMarketID"),
+    Column("comment_count", "commentCount"),
+    Column("cyom", "cyom"),
+    Column("show_all_outcomes", "showAllOutcomes"),
+    Column("show_market_images", "showMarketImages"),
+    Column("enable_neg_risk", "enableNegRisk"),
+    Column("automatically_active", "automaticallyActive"),
+    Column("gmp_chart_mode", "gmpChartMode"),
+    Column("neg_risk_augmented", "negRiskAugmented"),
+])
+
+TAGS = RecordMapper("tags", [
+    Column("event_id", PARENT_ID),
+    Column("id", "id"),
+    Column("label", "label"),
+    Column("slug", "slug"),
+    Column("force_show", "forceShow"),
+    Column("published_at", "publishedAt"),
+    Column("updated_by", "updatedBy"),
+    Column("created_at", "createdAt"),
+    Column("updated_at", "updatedAt"),
+    Column("_sync", "_sync"),
+    Column("force_hide", "forceHide"),
+])
+
+MARKETS = RecordMapper("markets", [
+    Column("id", "id", required=True),
+    Column("event_id", PARENT_ID),
+    Column("question", "question"),
+    Column("condition_id", "conditionId"),
+    Column("slug", "slug"),
+    Column("resolution_source", "resolutionSource"),
+    Column("end_date", "endDate"),
+    Column("liquidity", "liquidity"),
+    Column("start_date", "startDate"),
+    Column("image", "image"),
+    Column("icon", "icon"),
+    Column("description", "description"),
+    Column("outcomes", "outcomes", parse_json),
+    Column("outcome_prices", "outcomePrices", parse_json),
+    Column("volume", "volume"),
+    Column("active", "active"),
+    Column("closed", "closed"),
+    Column("market_maker_address", "marketMakerAddress"),
+    Column("created_at", "createdAt"),
+    Column("updated_at", "updatedAt"),
+    Column("new", "new"),
+    Column("featured", "featured"),
+    Column("submitted_by", "submitted_by"),
+    Column("archived", "archived"),
+    Column("resolved_by", "resolvedBy"),
+    Column("restricted", "restricted"),
+    Column("group_item_title", "groupItemTitle"),
+    Column("group_item_threshold", "groupItemThreshold"),
+    Column("question_id", "questionID"),
+    Column("enable_order_book", "enableOrderBook"),
+    Column("order_price_min_tick_size", "orderPriceMinTickSize"),
+    Column("order_min_size", "orderMinSize"),
+    Column("volume_num", "volumeNum"),
+    Column("liquidity_num", "liquidityNum"),
+    Column("end_date_iso", "endDateIso"),
+    Column("start_date_iso", "startDateIso"),
+    Column("has_reviewed_dates", "hasReviewedDates"),
+    Column("volume_24hr", "volume24hr"),
+    Column("clob_token_ids", "clobTokenIds", parse_json),
+    Column("uma_bond", "umaBond"),
+    Column("uma_reward", "umaReward"),
+    Column("volume_24hr_clob", "volume24hrClob"),
+    Column("volume_clob", "volumeClob"),
+    Column("liquidity_clob", "liquidityClob"),
+    Column("accepting_orders", "acceptingOrders"),
+    Column("neg_risk", "negRisk"),
+    Column("neg_risk_market_id", "negRiskMarketID"),
+    Column("neg_risk_request_id", "negRiskRequestID"),
+    Column("_sync", "_sync"),
+    Column("ready", "ready"),
+    Column("funded", "funded"),
+    Column("accepting_orders_timestamp", "acceptingOrdersTimestamp"),
+    Column("cyom", "cyom"),
+    Column("competitive", "competitive"),
+    Column("pager_duty_notification_enabled", "pagerDutyNotificationEnabled"),
+    Column("approved", "approved"),
+    Column("clob_rewards", "clobRewards"),
+    Column("rewards_min_size", "rewardsMinSize"),
+    Column("rewards_max_spread", "rewardsMaxSpread"),
+    Column("spread", "spread"),
+    Column("one_day_price_change", "oneDayPriceChange"),
+    Column("last_trade_price", "lastTradePrice"),
+    Column("best_bid", "bestBid"),
+    Column("best_ask", "bestAsk"),
+    Column("automatically_active", "automaticallyActive"),
+    Column("clear_book_on_start", "clearBookOnStart"),
+    Column("series_color", "seriesColor"),
+    Column("show_gmp_series", "showGmpSeries"),
+    Column("show_gmp_outcome", "showGmpOutcome"),
+    Column("manual_activation", "manualActivation"),
+    Column("neg_risk_other", "negRiskOther"),
+])
+
+# /prices-history の {"t": ..., "p": ...}
+PRICES = RecordMapper("prices", [
+    Column("market_id", PARENT_ID),
+    Column("timestamp", "t"),
+    Column("price", "p"),
+])
+
+# 全アウトカムのトークンごとの価格履歴 (context={"token_id": ...})
+TOKEN_PRICES = RecordMapper("token_prices", [
+    Column("market_id", PARENT_ID),
+    Column("token_id", Context("token_id")),
+    Column("timestamp", "t"),
+    Column("price", "p"),
+])
+
+MAPPERS = {mapper.table: mapper for mapper in (EVENTS, TAGS, MARKETS, PRICES, TOKEN_PRICES)}
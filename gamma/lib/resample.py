@@ -0,0 +1,152 @@
+from typing import Dict, Iterable, Optional, Sequence, Tuple
+
+import numpy as np
+
+from gamma.lib.price_store import PriceStore
+
+OHLC_DTYPE = np.dtype([
+    ('t', '<i8'),
+    ('open', '<f8'),
+    ('high', '<f8'),
+    ('low', '<f8'),
+    ('close', '<f8'),
+    ('count', '<i8'),
+])
+
+
+def _sorted(timestamps: np.ndarray, prices: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    timestamps = np.asarray(timestamps, dtype=np.int64)
+    prices = np.asarray(prices, dtype=np.float64)
+    if len(timestamps) > 1 and np.any(timestamps[1:] < timestamps[:-1]):
+        order = np.argsort(timestamps, kind='stable')
+        timestamps, prices = timestamps[order], prices[order]
+    return timestamps, prices
+
+
+def _bucket_starts(keys: np.ndarray) -> np.ndarray:
+    """Indices where a run of equal keys starts (keys must be sorted)."""
+    if len(keys) == 0:
+        return np.empty(0, dtype=np.int64)
+    return np.concatenate(([0], np.flatnonzero(keys[1:] != keys[:-1]) + 1))
+
+
+def resample_last(timestamps: np.ndarray, prices: np.ndarray, fidelity: int,
+                  fill: bool = False) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Downsamples a price series to the last price of every bucket.
+
+    Args:
+        timestamps: UNIX timestamps (seconds)
+        prices: Prices
+        fidelity: Bucket size in minutes (same meaning as the CLOB fidelity parameter)
+        fill: Return every bucket between the first and the last one, carrying
+            the last price forward into empty buckets
+
+    Returns:
+        (bucket start timestamps, last price of each bucket)
+    """
+    timestamps, prices = _sorted(timestamps, prices)
+    step = fidelity * 60
+    buckets = timestamps // step
+    starts = _bucket_starts(buckets)
+    if len(starts) == 0:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float64)
+    ends = np.append(starts[1:], len(timestamps)) - 1
+    bucket_ids = buckets[starts]
+    last = prices[ends]
+    if not fill:
+        return bucket_ids * step, last
+
+    grid = np.arange(bucket_ids[0], bucket_ids[-1] + 1)
+    # 各グリッドについて、それ以前で最も新しいバケットの位置を探す
+    positions = np.searchsorted(bucket_ids, grid, side='right') - 1
+    return grid * step, last[positions]
+
+
+def resample_ohlc(timestamps: np.ndarray, prices: np.ndarray, fidelity: int) -> np.ndarray:
+    """
+    Downsamples a price series to open/high/low/close per bucket.
+
+    Returns:
+        Structured array of OHLC_DTYPE, one element per non-empty bucket
+    """
+    timestamps, prices = _sorted(timestamps, prices)
+    step = fidelity * 60
+    buckets = timestamps // step
+    starts = _bucket_starts(buckets)
+    result = np.empty(len(starts), dtype=OHLC_DTYPE)
+    if len(starts) == 0:
+        return result
+    ends = np.append(starts[1:], len(timestamps))
+    result['t'] = buckets[starts] * step
+    result['open'] = prices[starts]
+    result['high'] = np.maximum.reduceat(prices, starts)
+    result['low'] = np.minimum.reduceat(prices, starts)
+    result['close'] = prices[ends - 1]
+    result['count'] = ends - starts
+    return result
+
+
+def resample_fidelities(timestamps: np.ndarray, prices: np.ndarray,
+                        fidelities: Sequence[int] = (1, 5, 15, 30, 60, 720)) -> Dict[int, np.ndarray]:
+    """
+    Builds OHLC views of one fine-grained series at several fidelities, instead
+    of requesting the same market from the CLOB once per fidelity.
+
+    Returns:
+        {fidelity: OHLC array}
+    """
+    timestamps, prices = _sorted(timestamps, prices)
+    return {fidelity: resample_ohlc(timestamps, prices, fidelity) for fidelity in fidelities}
+
+
+def resample_many(series: Dict[str, Tuple[np.ndarray, np.ndarray]], fidelity: int) -> Dict[str, np.ndarray]:
+    """
+    Resamples many markets to OHLC in a single vectorized pass.
+
+    All series are concatenated and bucketed by (market, bucket), so the cost
+    is a few NumPy operations over all points instead of a Python loop per bucket.
+
+    Args:
+        series: {market_id: (timestamps, prices)}. Each series must be sorted by timestamp
+        fidelity: Bucket size in minutes
+
+    Returns:
+        {market_id: OHLC array}
+    """
+    market_ids = list(series)
+    if not market_ids:
+        return {}
+    lengths = np.array([len(series[market_id][0]) for market_id in market_ids], dtype=np.int64)
+    timestamps = np.concatenate([np.asarray(series[market_id][0], dtype=np.int64) for market_id in market_ids])
+    prices = np.concatenate([np.asarray(series[market_id][1], dtype=np.float64) for market_id in market_ids])
+    owners = np.repeat(np.arange(len(market_ids)), lengths)
+
+    step = fidelity * 60
+    buckets = timestamps // step
+    # マーケットの境界でもバケットを区切る
+    boundary = (buckets[1:] != buckets[:-1]) | (owners[1:] != owners[:-1])
+    starts = np.concatenate(([0], np.flatnonzero(boundary) + 1)) if len(timestamps) else np.empty(0, dtype=np.int64)
+
+    ohlc = np.empty(len(starts), dtype=OHLC_DTYPE)
+    if len(starts):
+        ends = np.append(starts[1:], len(timestamps))
+        ohlc['t'] = buckets[starts] * step
+        ohlc['open'] = prices[starts]
+        ohlc['high'] = np.maximum.reduceat(prices, starts)
+        ohlc['low'] = np.minimum.reduceat(prices, starts)
+        ohlc['close'] = prices[ends - 1]
+        ohlc['count'] = ends - starts
+
+    # 各マーケットのバケット範囲に分割する
+    bucket_owners = owners[starts] if len(starts) else np.empty(0, dtype=np.int64)
+    splits = np.searchsorted(bucket_owners, np.arange(1, len(market_ids)))
+    return dict(zip(market_ids, np.split(ohlc, splits)))
+
+
+def resample_store(store: PriceStore, fidelity: int, market_ids: Optional[Iterable[str]] = None) -> Dict[str, np.ndarray]:
+    """
+    Resamples markets of a local PriceStore (default: all) to OHLC at one fidelity.
+    """
+    series = {market_id: (timestamps, prices) for market_id, timestamps, prices in store.iter_markets(market_ids)}
+    return resample_many(series, fidelity)
@@ -0,0 +1,142 @@
+import os
+import json
+import time
+import atexit
+import threading
+from typing import Optional, Tuple
+
+# 時間の定数（秒単位）
+HOUR = 3600
+HOURS_6 = HOUR * 6
+DAY = HOUR * 24
+WEEK = DAY * 7    # 168時間
+MONTH = DAY * 30  # 720時間
+
+# (マーケットの経過時間の上限, interval, fidelity)
+# CLOBはintervalごとに返す点数に上限があるため、期間が長いほど粗いfidelityを使う
+RESOLUTION_TABLE = [
+    (HOUR, '1h', 1),
+    (HOURS_6, '6h', 1),
+    (DAY, '1d', 5),
+    (WEEK, '1w', 15),
+    (MONTH, '1m', 60),
+    (None, 'max', 720),
+]
+
+# 空のレスポンスが返った場合に次回試すfidelity
+FALLBACK_FIDELITY = {
+    ('1w', 15): 30,
+}
+
+# 記憶が無いトークンで初回のみ比較し、点数の多い方を記憶するfidelity
+COMPARE_FIDELITIES = {
+    '1w': (15, 30),
+}
+
+DEFAULT_PLANNER_PATH = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "output", "state", "resolution_plan.json")
+
+
+class ResolutionPlanner:
+    """
+    Chooses interval/fidelity for an open market's token so that it costs one request.
+
+    The choice is made from the market's age and RESOLUTION_TABLE. The
+    fidelity that actually returned data is remembered per outcome token
+    (and persisted to `path`), so a token whose default fidelity came back
+    empty is asked with its fallback on the next run instead of probing.
+    For intervals in COMPARE_FIDELITIES, a token without memory is asked
+    once with every listed fidelity and the one with more points is kept.
+
+    Args:
+        path: JSON file the per-token memory is persisted to (None = in-memory only)
+    """
+
+    def __init__(self, path: Optional[str] = DEFAULT_PLANNER_PATH):
+        self.path = path
+        self._memory = {}
+        self._dirty = False
+        self._lock = threading.Lock()
+        if path is not None and os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as f:
+                self._memory = json.load(f)
+
+    def plan(self, token_id, start_ts: int, now: Optional[int] = None) -> Tuple[str, int]:
+        """
+        Returns (interval, fidelity) for a token of a market that started at start_ts.
+        """
+        if now is None:
+            now = int(time.time())
+        age = now - start_ts
+
+        for max_age, interval, fidelity in RESOLUTION_TABLE:
+            if max_age is None or age < max_age:
+                break
+
+        with self._lock:
+            remembered = self._memory.get(str(token_id))
+        if remembered is not None and remembered.get('interval') == interval:
+            fidelity = remembered['fidelity']
+        return interval, fidelity
+
+    def comparison(self, token_id, interval: str) -> Tuple[int, ...]:
+        """
+        Returns the fidelities to compare for a token, or () if one is already remembered for this interval.
+        """
+        with self._lock:
+            remembered = self._memory.get(str(token_id))
+        if remembered is not None and remembered.get('interval') == interval:
+            return ()
+        return COMPARE_FIDELITIES.get(interval, ())
+
+    def record(self, token_id, interval: str, fidelity: int, points: int):
+        """
+        Remembers the outcome of a planned request.
+
+        Args:
+            token_id: CLOB token ID
+            interval: Interval that was requested
+            fidelity: Fidelity that was requested
+            points: Number of points the response contained
+        """
+        if points > 0:
+            entry = {'interval': interval, 'fidelity': fidelity}
+        else:
+            fallback = FALLBACK_FIDELITY.get((interval, fidelity))
+            if fallback is None:
+                return
+            entry = {'interval': interval, 'fidelity': fallback}
+
+        with self._lock:
+            if self._memory.get(str(token_id)) != entry:
+                self._memory[str(token_id)] = entry
+                self._dirty = True
+
+    def save(self):
+        """Persists the per-market memory if it changed."""
+        if self.path is None:
+            return
+        with self._lock:
+            if not self._dirty:
+                return
+            snapshot = dict(self._memory)
+            self._dirty = False
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(snapshot, f)
+        os.replace(tmp_path, self.path)
+
+
+_default_planner = None
+_default_planner_lock = threading.Lock()
+
+
+def default_planner() -> ResolutionPlanner:
+    """Returns the process-wide planner persisted under gamma/output/state, saved automatically at exit."""
+    global _default_planner
+    with _default_planner_lock:
+        if _default_planner is None:
+            _default_planner = ResolutionPlanner()
+            atexit.register(_default_planner.save)
+        return _default_planner
@@ -0,0 +1,177 @@
+import os
+import json
+import sqlite3
+import threading
+from typing import Iterable, List
+
+from gamma.lib.known_keys import KEY_COLUMNS, CONFLICT_TARGETS, KnownKeys
+from gamma.lib.record_mappers import MAPPERS
+from gamma.lib.batch_writer import TABLE_PARENTS
+
+# gamma/output/polymarket.sqlite
+DEFAULT_SQLITE_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "output", "polymarket.sqlite")
+
+# insert: そのままINSERT / upsert: 既存行を更新 / skip: 既存行は無視
+WRITE_MODES = ("insert", "upsert", "skip")
+
+# 追記のみで更新されないテーブル
+PRICE_TABLES = ("prices", "token_prices")
+
+
+class Sink:
+    """
+    Destination the loader writes rows to.
+
+    Args:
+        mode: 'insert', 'upsert' or 'skip' (ignore rows whose key already exists).
+            prices/token_prices are immutable, so upsert mode also ignores existing price rows
+    """
+
+    def __init__(self, mode: str = "skip"):
+        if mode not in WRITE_MODES:
+            raise ValueError(f"Invalid write mode: {mode}")
+        self.mode = mode
+
+    def write(self, table: str, rows: List[dict]):
+        """Writes rows to a table; raises on failure."""
+        raise NotImplementedError
+
+    def prefetch_keys(self, known_keys: KnownKeys, market_ids: Iterable[str], token_prices: bool = False):
+        """
+        Loads the keys of existing rows and the latest price timestamp per market into known_keys.
+
+        Args:
+            known_keys: KnownKeys to fill
+            market_ids: Markets to load price watermarks for
+            token_prices: Also load the latest token_prices timestamp per market and token
+        """
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
+
+
+class SupabaseSink(Sink):
+    """
+    Writes through the Supabase (PostgREST) API.
+
+    Args:
+        client: supabase Client
+        mode: Write mode
+    """
+
+    def __init__(self, client, mode: str = "skip"):
+        super().__init__(mode)
+        self.client = client
+
+    def write(self, table: str, rows: List[dict]):
+        if self.mode == "insert":
+            self.client.table(table).insert(rows).execute()
+            return
+        # 価格履歴は不変のため常に既存行を無視する
+        ignore_duplicates = self.mode == "skip" or table in PRICE_TABLES
+        self.client.table(table).upsert(
+            rows, on_conflict=CONFLICT_TARGETS[table], ignore_duplicates=ignore_duplicates).execute()
+
+    def prefetch_keys(self, known_keys: KnownKeys, market_ids: Iterable[str], token_prices: bool = False):
+        market_ids = list(market_ids)
+        for table in ("events", "markets", "tags"):
+            known_keys.load_keys(self.client, table)
+        known_keys.load_price_watermarks(self.client, market_ids)
+        if token_prices:
+            known_keys.load_token_watermarks(self.client, market_ids)
+
+
+class SQLiteSink(Sink):
+    """
+    Writes to a local SQLite database with the same tables and columns as
+    the Supabase schema (derived from record_mappers), for offline loads,
+    benchmarks and analytics.
+
+    JSON columns (outcomes, clob_token_ids, ...) are stored as JSON text.
+
+    Args:
+        path: SQLite file
+        mode: Write mode
+    """
+
+    def __init__(self, path: str = DEFAULT_SQLITE_PATH, mode: str = "skip"):
+        super().__init__(mode)
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._lock = threading.Lock()
+        self._statements = {}
+        for table in TABLE_PARENTS:
+            self._conn.execute(self._create_table(table))
+        self._conn.commit()
+
+    @staticmethod
+    def _create_table(table: str) -> str:
+        columns = ", ".join(f'"{column}"' for column in MAPPERS[table].columns)
+        key = ", ".join(f'"{column}"' for column in KEY_COLUMNS[table])
+        return f'CREATE TABLE IF NOT EXISTS "{table}" ({columns}, PRIMARY KEY ({key}))'
+
+    def _statement(self, table: str) -> str:
+        statement = self._statements.get(table)
+        if statement is None:
+            columns = MAPPERS[table].columns
+            names = ", ".join(f'"{column}"' for column in columns)
+            placeholders = ", ".join("?" * len(columns))
+            if self.mode == "upsert" and table not in PRICE_TABLES:
+                key = ", ".join(f'"{column}"' for column in KEY_COLUMNS[table])
+                updates = ", ".join(f'"{column}" = excluded."{column}"'
+                                    for column in columns if column not in KEY_COLUMNS[table])
+                statement = (f'INSERT INTO "{table}" ({names}) VALUES ({placeholders}) '
+                             f'ON CONFLICT ({key}) DO UPDATE SET {updates}')
+            elif self.mode == "insert":
+                statement = f'INSERT INTO "{table}" ({names}) VALUES ({placeholders})'
+            else:
+                statement = f'INSERT OR IGNORE INTO "{table}" ({names}) VALUES ({placeholders})'
+            self._statements[table] = statement
+        return statement
+
+    @staticmethod
+    def _value(value):
+        if isinstance(value, (list, dict)):
+            return json.dumps(value, ensure_ascii=False)
+        return value
+
+    def write(self, table: str, rows: List[dict]):
+        columns = MAPPERS[table].columns
+        value = self._value
+        params = [tuple(value(row.get(column)) for column in columns) for row in rows]
+        with self._lock:
+            with self._conn:
+                self._conn.executemany(self._statement(table), params)
+
+    def prefetch_keys(self, known_keys: KnownKeys, market_ids: Iterable[str], token_prices: bool = False):
+        with self._lock:
+            for table in ("events", "markets", "tags"):
+                columns = KEY_COLUMNS[table]
+                names = ", ".join(f'"{column}"' for column in columns)
+                rows = self._conn.execute(f'SELECT {names} FROM "{table}"').fetchall()
+                known_keys.add(table, [dict(zip(columns, row)) for row in rows])
+            rows = self._conn.execute(
+                'SELECT market_id, MAX("timestamp") FROM prices GROUP BY market_id').fetchall()
+            token_rows = self._conn.execute(
+                'SELECT market_id, token_id, MAX("timestamp") FROM token_prices GROUP BY market_id, token_id'
+            ).fetchall() if token_prices else []
+        known_keys.add("prices", [{"market_id": market_id, "timestamp": timestamp} for market_id, timestamp in rows])
+        known_keys.add("token_prices", [{"market_id": market_id, "token_id": token_id, "timestamp": timestamp}
+                                        for market_id, token_id, timestamp in token_rows])
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,167 @@
+import os
+import gzip
+import json
+from itertools import islice
+from typing import Iterable, Iterator, Optional, Tuple
+
+from gamma.lib.snapshot_index import SnapshotIndex
+
+# gamma/output
+OUTPUT_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "output")
+
+# 探索するスナップショットファイル名
+SNAPSHOT_CANDIDATES = ["events.ndjson.gz", "events.ndjson", "events.json"]
+
+
+def _open_text(path: str, mode: str):
+    if path.endswith('.gz'):
+        return gzip.open(path, mode + 't', encoding='utf-8')
+    return open(path, mode, encoding='utf-8')
+
+
+class SnapshotWriter:
+    """
+    Streams events to an NDJSON snapshot (one event per line).
+
+    The snapshot is written to a temporary file and moved into place on
+    close, so readers never see a half-written file. Uncompressed snapshots
+    also get a byte-offset index (see SnapshotIndex) written next to them.
+
+    Args:
+        filename: Snapshot file name or absolute path (.ndjson extension will be added automatically)
+        compress: Write a gzip-compressed snapshot (.gz extension will be added automatically)
+    """
+
+    def __init__(self, filename: str = "events.ndjson", compress: bool = False):
+        if not filename.endswith('.ndjson') and not filename.endswith('.ndjson.gz'):
+            filename += '.ndjson'
+        if compress and not filename.endswith('.gz'):
+            filename += '.gz'
+        self.path = filename if os.path.isabs(filename) else os.path.join(OUTPUT_DIR, filename)
+        self.tmp_path = self.path + ".tmp"
+        self.event_count = 0
+        self.market_count = 0
+        self.first_created_at = None
+        self.last_created_at = None
+        self.compress = self.path.endswith('.gz')
+
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self._file = gzip.open(self.tmp_path, 'wb') if self.compress else open(self.tmp_path, 'wb')
+        # インデックス用のバイトオフセット (非圧縮時のみ)
+        self._offset = 0
+        self._offsets = []
+        self._event_ids = []
+        self._market_ids = {}
+
+    def write_event(self, event: dict):
+        line = (json.dumps(event, ensure_ascii=False, separators=(',', ':')) + '\n').encode('utf-8')
+        self._file.write(line)
+        if not self.compress:
+            SnapshotIndex._add(self._offsets, self._event_ids, self._market_ids, self._offset, event)
+            self._offset += len(line)
+        self.event_count += 1
+        self.market_count += len(event.get('markets', []))
+        if self.first_created_at is None:
+            self.first_created_at = event.get('createdAt')
+        self.last_created_at = event.get('createdAt')
+
+    def write_events(self, events: Iterable[dict]):
+        for event in events:
+            self.write_event(event)
+
+    def close(self):
+        if self._file.closed:
+            return
+        self._file.close()
+        os.replace(self.tmp_path, self.path)
+        if not self.compress:
+            SnapshotIndex(self.path, self._offsets + [self._offset], self._event_ids, self._market_ids).save()
+
+    def abort(self):
+        """Discards the partially written snapshot."""
+        if not self._file.closed:
+            self._file.close()
+        if os.path.exists(self.tmp_path):
+            os.remove(self.tmp_path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+        return False
+
+
+def find_snapshot(output_dir: str = OUTPUT_DIR) -> str:
+    """
+    Returns the path of the events snapshot in output_dir.
+
+    If several snapshots exist, the most recently written one is used.
+    """
+    paths = [os.path.join(output_dir, name) for name in SNAPSHOT_CANDIDATES]
+    paths = [path for path in paths if os.path.exists(path)]
+    if paths:
+        return max(paths, key=os.path.getmtime)
+    raise FileNotFoundError(f"No events snapshot found in {output_dir}")
+
+
+def iter_events(path: Optional[str] = None) -> Iterator[dict]:
+    """
+    Yields events from a snapshot one at a time.
+
+    Args:
+        path: Snapshot path (.ndjson, .ndjson.gz or legacy .json). If None, find_snapshot() is used
+
+    Yields:
+        Event dicts in snapshot order
+    """
+    if path is None:
+        path = find_snapshot()
+
+    if path.endswith('.json'):
+        # 旧形式 (インデント付きJSON配列) は全体を読み込むしかない
+        with open(path, 'r', encoding='utf-8') as f:
+            yield from json.load(f)
+        return
+
+    with _open_text(path, 'r') as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+def count_events(path: Optional[str] = None) -> Tuple[int, int]:
+    """
+    Counts events and markets in a snapshot without keeping them in memory.
+
+    Returns:
+        (number of events, number of markets)
+    """
+    event_count = 0
+    market_count = 0
+    for event in iter_events(path):
+        event_count += 1
+        market_count += len(event.get('markets', []))
+    return event_count, market_count
+
+
+def load_event_range(start_index: int, end_index: int, path: Optional[str] = None) -> list:
+    """
+    Loads events[start_index:end_index + 1] from a snapshot.
+
+    Uncompressed NDJSON snapshots are read through their byte-offset index,
+    so only the requested events are decoded. Other formats are streamed
+    up to end_index.
+
+    Returns:
+        List of events (shorter than requested if the snapshot ends early)
+    """
+    if path is None:
+        path = find_snapshot()
+    if path.endswith('.ndjson'):
+        with SnapshotIndex.open(path) as index:
+            return index.slice(start_index, end_index + 1)
+    return list(islice(iter_events(path), start_index, end_index + 1))
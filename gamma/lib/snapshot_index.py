@@ -0,0 +1,138 @@
+import os
+import json
+import mmap
+from typing import Dict, List, Optional
+
+
+def index_path_for(snapshot_path: str) -> str:
+    return snapshot_path + ".idx.json"
+
+
+class SnapshotIndex:
+    """
+    Byte-offset index over an uncompressed NDJSON events snapshot.
+
+    Maps event index, event id and market id to the byte range of the
+    event's line, so single records can be decoded from a memory-mapped
+    snapshot without parsing the rest of the file.
+
+    Args:
+        snapshot_path: Path of the .ndjson snapshot
+        offsets: Byte offset of every line, plus the file size as the last element
+        event_ids: Event id of every line
+        market_ids: Market id -> event index
+    """
+
+    def __init__(self, snapshot_path: str, offsets: List[int], event_ids: List[str], market_ids: Dict[str, int]):
+        self.snapshot_path = snapshot_path
+        self.offsets = offsets
+        self.event_ids = event_ids
+        self.market_ids = market_ids
+        self._event_positions = {event_id: i for i, event_id in enumerate(event_ids)}
+        self._file = None
+        self._mmap = None
+
+    @classmethod
+    def build(cls, snapshot_path: str) -> "SnapshotIndex":
+        """Scans a snapshot once and builds its index."""
+        offsets = []
+        event_ids = []
+        market_ids = {}
+        offset = 0
+        with open(snapshot_path, 'rb') as f:
+            for line in f:
+                if line.strip():
+                    event = json.loads(line)
+                    cls._add(offsets, event_ids, market_ids, offset, event)
+                offset += len(line)
+        offsets.append(offset)
+        return cls(snapshot_path, offsets, event_ids, market_ids)
+
+    @staticmethod
+    def _add(offsets: List[int], event_ids: List[str], market_ids: Dict[str, int], offset: int, event: dict):
+        position = len(event_ids)
+        offsets.append(offset)
+        event_ids.append(str(event['id']))
+        for market in event.get('markets', []):
+            market_ids[str(market['id'])] = position
+
+    def save(self):
+        """Writes the index next to the snapshot."""
+        path = index_path_for(self.snapshot_path)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({
+                "snapshot_size": self.offsets[-1],
+                "offsets": self.offsets,
+                "event_ids": self.event_ids,
+                "market_ids": self.market_ids,
+            }, f, separators=(',', ':'))
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, snapshot_path: str) -> Optional["SnapshotIndex"]:
+        """
+        Loads the index of a snapshot. Returns None if it is missing or stale.
+        """
+        path = index_path_for(snapshot_path)
+        if not os.path.exists(path) or not os.path.exists(snapshot_path):
+            return None
+        with open(path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        if data.get("snapshot_size") != os.path.getsize(snapshot_path):
+            return None
+        return cls(snapshot_path, data["offsets"], data["event_ids"], data["market_ids"])
+
+    @classmethod
+    def open(cls, snapshot_path: str) -> "SnapshotIndex":
+        """Loads the index of a snapshot, building and saving it first if needed."""
+        index = cls.load(snapshot_path)
+        if index is None:
+            index = cls.build(snapshot_path)
+            index.save()
+        return index
+
+    def __len__(self) -> int:
+        return len(self.event_ids)
+
+    def _buffer(self):
+        if self._mmap is None:
+            self._file = open(self.snapshot_path, 'rb')
+            self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        return self._mmap
+
+    def get(self, position: int) -> dict:
+        """Decodes the event at a given index of the snapshot."""
+        if position < 0:
+            position += len(self)
+        if not 0 <= position < len(self):
+            raise IndexError(f"Event index {position} out of range")
+        start, end = self.offsets[position], self.offsets[position + 1]
+        return json.loads(self._buffer()[start:end])
+
+    def slice(self, start: int, end: int) -> List[dict]:
+        """Decodes events[start:end]."""
+        return [self.get(i) for i in range(max(start, 0), min(end, len(self)))]
+
+    def by_event_id(self, event_id) -> Optional[dict]:
+        position = self._event_positions.get(str(event_id))
+        return self.get(position) if position is not None else None
+
+    def by_market_id(self, market_id) -> Optional[dict]:
+        """Returns the event containing the given market."""
+        position = self.market_ids.get(str(market_id))
+        return self.get(position) if position is not None else None
+
+    def close(self):
+        if self._mmap is not None:
+            self._mmap.close()
+            self._file.close()
+            self._mmap = None
+            self._file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
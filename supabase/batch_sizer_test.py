@@ -0,0 +1,52 @@
+import os
+import sys
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+project_root = os.path.dirname(current_dir)
+sys.path.append(project_root)
+
+from gamma.lib.batch_sizer import AdaptiveBatchSizer, STATEMENT_TIMEOUT_CODE
+
+# データベース不要で実行できる:
+#   python supabase/batch_sizer_test.py
+
+
+class StatementTimeout(Exception):
+    code = STATEMENT_TIMEOUT_CODE
+
+
+# 300行を超えるバッチはタイムアウトする書き込み先
+LIMIT = 300
+written = []
+
+
+def write_fn(table, batch):
+    if len(batch) > LIMIT:
+        raise StatementTimeout("canceling statement due to statement timeout")
+    written.extend(batch)
+
+
+sizer = AdaptiveBatchSizer(initial_size=1000, min_size=100)
+sizer.write("prices", [{"i": i} for i in range(1000)], write_fn)
+assert len(written) == 1000, len(written)
+# 1000 -> 500 -> 250 と半減し、最後にタイムアウトしたのは500行
+failed = 500
+print("after timeouts", sizer.sizes())
+
+# 高速な書き込みが続いてもタイムアウトしたサイズ未満に留まる
+for _ in range(20):
+    size = sizer.size("prices")
+    sizer.observe("prices", size, 0.01)
+    assert sizer.size("prices") < failed, sizer.sizes()
+print("after fast writes", sizer.sizes())
+
+# 上限未満でもタイムアウトすれば上限が下がり、やがて書き込める大きさに収まる
+for _ in range(10):
+    sizer.write("prices", [{"i": i} for i in range(2000)], write_fn)
+assert sizer.size("prices") <= LIMIT, sizer.sizes()
+print("after repeated writes", sizer.sizes())
+
+# 別のテーブルは影響を受けない
+sizer.observe("events", 1000, 0.01)
+assert sizer.size("events") == 2000, sizer.sizes()
+print("ok")
@@ -0,0 +1,38 @@
+import os
+import sys
+import argparse
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+project_root = os.path.dirname(current_dir)
+sys.path.append(project_root)
+
+from gamma.lib.negative_cache import NegativeCache, DEFAULT_NEGATIVE_CACHE_PATH, DEFAULT_NEGATIVE_TTL
+
+parser = argparse.ArgumentParser(description='Inspect and maintain the negative cache of markets without price history')
+parser.add_argument('--path', default=DEFAULT_NEGATIVE_CACHE_PATH, help='SQLite file of the negative cache')
+parser.add_argument('--ttl', type=int, default=DEFAULT_NEGATIVE_TTL, help='Seconds an entry stays valid (0 = forever)')
+parser.add_argument('--import-csv', metavar='CSV', action='append',
+                    help='Import a closed_no.csv (market_id,startDate,endDate,createdAt) as empty markets (repeatable)')
+parser.add_argument('--purge', action='store_true', help='Delete expired entries')
+parser.add_argument('--discard', metavar='MARKET_ID', action='append', help='Forget a market (repeatable)')
+parser.add_argument('--clear', action='store_true', help='Delete every entry')
+args = parser.parse_args()
+
+cache = NegativeCache(args.path, ttl=args.ttl)
+
+if args.clear:
+    cache.clear()
+    print("Cleared.")
+for path in args.import_csv or []:
+    print(f"Imported {cache.import_csv(path)} markets from {path}")
+for market_id in args.discard or []:
+    cache.discard(market_id)
+if args.purge:
+    print(f"Purged {cache.purge_expired()} expired entries")
+
+counts = cache.counts()
+for reason, count in sorted(counts.items()):
+    print(f"{reason}: {count}")
+if not counts:
+    print("No entries.")
+cache.close()
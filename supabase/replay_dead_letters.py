@@ -0,0 +1,79 @@
+import os
+import sys
+import argparse
+from dotenv import load_dotenv
+from tqdm import tqdm
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+project_root = os.path.dirname(current_dir)
+sys.path.append(project_root)
+
+from gamma.lib.dead_letter import DeadLetterStore
+from gamma.lib.sinks import SupabaseSink, SQLiteSink, DEFAULT_SQLITE_PATH
+from gamma.lib.checkpoint import CheckpointJournal
+
+parser = argparse.ArgumentParser(description='Replay write batches that failed in script_v1.py')
+parser.add_argument('--sink', choices=['supabase', 'sqlite'], default='supabase',
+                    help='Destination the failed batches were meant for (CONFIG["SINK"] of script_v1.py)')
+parser.add_argument('--sqlite-path', default=DEFAULT_SQLITE_PATH, help='SQLite file of the sqlite sink')
+parser.add_argument('--store', help='Dead letter store written by script_v1.py (default: log/dead_letters_<sink>.db)')
+parser.add_argument('--journal',
+                    help='Checkpoint journal to record replayed rows in (default: log/checkpoint_<sink>.db, "" to disable)')
+parser.add_argument('--table', action='append', help='Only replay this table (repeatable)')
+parser.add_argument('--batch-size', type=int, default=10000, help='Rows per bulk write')
+parser.add_argument('--copy', action='store_true', help='Write prices with COPY via DATABASE_URL')
+parser.add_argument('--list', action='store_true', help='Only show what is stored')
+args = parser.parse_args()
+
+store = DeadLetterStore(args.store or f"log/dead_letters_{args.sink}.db")
+counts = store.counts()
+for table, (batches, rows) in counts.items():
+    print(f"{table}: {batches} batches / {rows} rows")
+if args.list or not counts:
+    if not counts:
+        print("No dead letters.")
+    store.close()
+    sys.exit(0)
+
+load_dotenv()
+
+# 一部が前回の実行で書き込まれている可能性があるため、既存行は無視する
+if args.sink == "sqlite":
+    sink = SQLiteSink(args.sqlite_path, mode="skip")
+else:
+    from supabase import create_client
+    sink = SupabaseSink(create_client(os.getenv("SUPABASE_URL"), os.getenv("SUPABASE_KEY")), mode="skip")
+
+price_sink = None
+if args.copy:
+    from gamma.lib.pg_copy import PostgresCopySink
+    price_sink = PostgresCopySink(table="prices")
+
+journal_path = f"log/checkpoint_{args.sink}.db" if args.journal is None else args.journal
+journal = CheckpointJournal(journal_path) if journal_path else None
+
+def write(table_name, rows):
+    if table_name == "prices" and price_sink is not None:
+        price_sink.write(rows)
+    else:
+        sink.write(table_name, rows)
+    if journal is not None:
+        journal.on_committed(table_name, rows)
+
+total_rows = sum(rows for table, (batches, rows) in counts.items() if not args.table or table in args.table)
+pbar = tqdm(total=total_rows, dynamic_ncols=True, desc="Replaying")
+
+result = store.replay(write, tables=args.table, max_rows=args.batch_size,
+                      on_progress=lambda table, rows: pbar.update(rows))
+pbar.close()
+
+print("Summary of replay:")
+for table, summary in result.items():
+    print(f"{table}: {summary['rows']} rows replayed, {summary['failed']} rows failed")
+
+sink.close()
+if price_sink is not None:
+    price_sink.close()
+if journal is not None:
+    journal.close()
+store.close()
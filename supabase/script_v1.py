@@ -1,23 +1,52 @@
-import json
-from supabase import create_client, Client
 from dotenv import load_dotenv
 import os
 import sys
-from tqdm import tqdm
 import logging
-from concurrent.futures import ThreadPoolExecutor, as_completed
-from threading import Lock
 import time
 
 # 設定用ディクショナリ
 CONFIG = {
-    "BATCH_SIZE": 10000,
+    "BATCH_SIZE": 10000,     # 書き込みバッチの初期サイズ (以降はレイテンシに応じてテーブルごとに自動調整)
+    "BATCH_SIZE_MIN": 500,
+    "BATCH_SIZE_MAX": 50000,
+    "WRITE_TARGET_LATENCY": 2.0,  # 1回の書き込みの目標秒数。これを下回る間はバッチを大きくする
     "ERROR_LOG": "log/error_log.log",
-    "MAX_WORKERS_EVENTS": 100,
-    "MAX_WORKERS_MARKETS": 5,
-    "EVENT_CHUNK_SIZE": 100,
+    # ステージごとのワーカー数 (取得 -> 変換 -> 書き込み)。ステージ間はキューで接続する
+    "FETCH_WORKERS": 100,    # CLOBからの価格履歴取得
+    "TRANSFORM_WORKERS": 4,  # 価格履歴 -> prices行への変換
+    "WRITE_WORKERS": 8,      # BatchWriterへの投入とDBへの書き込み
+    "QUEUE_SIZE": 500,       # 各ステージの入力キューの上限 (超えると前段が待つ)
     "RETRY_COUNT": 5,       # 再試行回数
-    "RETRY_DELAY": 5        # 再試行前待機秒数
+    "RETRY_DELAY": 5,       # 再試行前待機秒数
+    "HTTP_POOL_MAXSIZE": 100,  # CLOB/Gammaへの同時接続数の上限 (全スレッドで共有)
+    "PRICE_STORE": True,     # 価格履歴をローカルの列指向ストア (gamma/output/prices) にも書き込む
+    # イベントをまたいでテーブルごとに行をまとめて書き込む
+    # pricesはBATCH_SIZE_MAXまで溜め、送信時にAdaptiveBatchSizerが分割する
+    "WRITER_MAX_ROWS": {"events": 500, "tags": 1000, "markets": 500, "prices": 50000},
+    "WRITER_MAX_BYTES": 8 * 1024 * 1024,
+    "WRITER_MAX_DELAY": 5,   # バッファ内で待機できる最大秒数
+    # 書き込み先 supabase: Supabase API / sqlite: ローカルのSQLite (SQLITE_PATH) にオフラインでロード
+    "SINK": "supabase",
+    "SQLITE_PATH": None,     # Noneの場合は gamma/output/polymarket.sqlite
+    # insert: 従来どおりINSERT / upsert: 既存行を更新 / skip: 既存行は送信しない (ON CONFLICT DO NOTHING)
+    "WRITE_MODE": "skip",
+    "PREFETCH_KEYS": True,   # 実行前にDB上の主キーと各マーケットの最新価格時刻を一括取得する
+    # オープン中のマーケットは保存済みの最新時刻より後の価格のみ取得する
+    "DELTA_FETCH": True,
+    "DELTA_SOURCE": "sink",  # sink: 書き込み先から一括取得した最新時刻 / price_store: ローカルの列指向ストア
+    # 全アウトカムのトークンを同時に取得し、token_prices (market_id, token_id, timestamp) にも書き込む。
+    # pricesには従来どおり最初のアウトカムを書き込む
+    "ALL_OUTCOMES": False,
+    "CHECKPOINT_JOURNAL": "log/checkpoint_{sink}.db",  # コミット済みの行を記録し、再実行時に続きから再開する
+    "RESUME": True,          # Falseの場合はジャーナルを消去して最初から実行する
+    # prices の書き込み先 postgrest: Supabase API経由 / copy: DATABASE_URL のPostgresへ直接COPY
+    "PRICES_SINK": "postgrest",
+    # リトライし尽くしたバッチの保存先 (supabase/replay_dead_letters.py で再送する)
+    "DEAD_LETTER_STORE": "log/dead_letters_{sink}.db",
+    "COPY_MAX_CONNECTIONS": 4,
+    "METRICS_INTERVAL": 10,  # コンソールへのサマリー出力間隔 (秒)
+    "METRICS_TEXTFILE": "log/metrics.prom",  # Prometheus形式のテキストファイル (Noneで無効)
+    "METRICS_PORT": None     # 指定するとhttp://127.0.0.1:<port>/metrics で公開する
 }
 
 current_dir = os.path.dirname(os.path.abspath(__file__))
@@ -25,13 +54,47 @@ project_root = os.path.dirname(current_dir)
 sys.path.append(project_root)
 
 from gamma.fetch_market_pricehistory.fetch_pricehistory import fetch_pricehistory
+from gamma.lib.pricehistory import fetch_market_token_histories, PRICEHISTORY_FETCHER
+from gamma.lib.snapshot import find_snapshot, iter_events
+from gamma.lib.http_session import configure_session, HOST_POOL_LIMITS
+from gamma.lib.price_store import PriceStore
+from gamma.lib.batch_writer import BatchWriter
+from gamma.lib.known_keys import KnownKeys
+from gamma.lib.price_merge import PriceMerger
+from gamma.lib.sinks import SupabaseSink, SQLiteSink, DEFAULT_SQLITE_PATH, PRICE_TABLES
+from gamma.lib.checkpoint import CheckpointJournal
+from gamma.lib.pipeline import Pipeline, Stage
+from gamma.lib.dead_letter import DeadLetterStore
+from gamma.lib.batch_sizer import AdaptiveBatchSizer, PartialWriteError, is_statement_timeout
+from gamma.lib.record_mappers import EVENTS, TAGS, MARKETS, PRICES, TOKEN_PRICES, parse_json
+from gamma.lib.metrics import (REGISTRY, MetricsReporter, PRICEHISTORY_REQUESTS, PRICEHISTORY_RETRIES,
+                               PRICEHISTORY_LATENCY)
+
+configure_session(pool_maxsize=CONFIG["HTTP_POOL_MAXSIZE"],
+                  host_limits={**HOST_POOL_LIMITS, "clob.polymarket.com": CONFIG["HTTP_POOL_MAXSIZE"]})
 
 load_dotenv()
 
-SUPABASE_URL = os.getenv("SUPABASE_URL")
-SUPABASE_KEY = os.getenv("SUPABASE_KEY")
+# 全テーブルの書き込み先
+if CONFIG["SINK"] == "sqlite":
+    sink = SQLiteSink(CONFIG["SQLITE_PATH"] or DEFAULT_SQLITE_PATH, mode=CONFIG["WRITE_MODE"])
+else:
+    from supabase import create_client
 
-supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
+    SUPABASE_URL = os.getenv("SUPABASE_URL")
+    SUPABASE_KEY = os.getenv("SUPABASE_KEY")
+
+    sink = SupabaseSink(create_client(SUPABASE_URL, SUPABASE_KEY), mode=CONFIG["WRITE_MODE"])
+
+price_store = PriceStore() if CONFIG["PRICE_STORE"] else None
+
+# pricesはJSONを経由せずCOPYで直接流し込む (psycopg2が必要)
+price_sink = None
+if CONFIG["PRICES_SINK"] == "copy":
+    from gamma.lib.pg_copy import PostgresCopySink
+    price_sink = PostgresCopySink(table="prices",
+                                  update=CONFIG["WRITE_MODE"] == "upsert",
+                                  max_connections=CONFIG["COPY_MAX_CONNECTIONS"])
 
 os.makedirs("log", exist_ok=True)
 
@@ -42,322 +105,323 @@ formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
 fh.setFormatter(formatter)
 logger.addHandler(fh)
 
-with open("../gamma/output/events.json", "r") as f:
-    event_data = json.load(f)
-
-total_markets = sum(len(event.get("markets", [])) for event in event_data)
-
-GREEN = "\033[32m"
-BLUE = "\033[34m"
-YELLOW = "\033[33m"
-RESET = "\033[0m"
-
-main_pbar_events = tqdm(total=len(event_data), position=0, dynamic_ncols=True, leave=True, desc=f"{GREEN}All Events{RESET}")
-main_pbar_markets = tqdm(total=total_markets, position=1, dynamic_ncols=True, leave=True, desc=f"{BLUE}All Markets{RESET}")
-main_pbar_prices = tqdm(total=0, position=2, dynamic_ncols=True, leave=True, desc=f"{YELLOW}All Prices{RESET}")
-
-pbar_threads = []
-for i in range(CONFIG["MAX_WORKERS_EVENTS"]):
-    p = tqdm(
-        total=1,
-        position=3+i,
-        dynamic_ncols=True,
-        leave=True,
-        bar_format="{desc}"
-    )
-    p.set_description(f"{GREEN}Thread-{i}{RESET}: Idle")
-    pbar_threads.append(p)
-
-thread_lock = Lock()
-next_chunk = 0
-total_chunks = (len(event_data) + CONFIG["EVENT_CHUNK_SIZE"] - 1) // CONFIG["EVENT_CHUNK_SIZE"]
-
-def safe_insert(table_name, record):
-    """単一レコード挿入用。エラー発生時にリトライ。"""
+# DBに既に存在する行は送信しない
+known_keys = KnownKeys()
+# この実行でキューに入れた価格の時刻 (重複した行でバッチ全体が主キー違反になるのを防ぐ)
+price_merger = PriceMerger()
+
+# 書き込みに失敗したバッチは捨てずに保存する
+dead_letters = DeadLetterStore(CONFIG["DEAD_LETTER_STORE"].format(sink=CONFIG["SINK"]))
+
+# スナップショットは全体を読み込まず、チャンク単位でストリーミングする
+snapshot_path = find_snapshot()
+
+# 中断後の再開用ジャーナル。同じスナップショットに対する未完了の実行のみ続きから再開する
+# 全行がコミットされたマーケットの時刻はPriceMergerから捨てる
+journal = CheckpointJournal(CONFIG["CHECKPOINT_JOURNAL"].format(sink=CONFIG["SINK"]),
+                            on_settled=price_merger.forget_market)
+if not CONFIG["RESUME"]:
+    journal.reset()
+if journal.start_run(f"{os.path.abspath(snapshot_path)}:{int(os.path.getmtime(snapshot_path))}") \
+        and journal.done_count("market_done") > 0:
+    print(f"Resuming: {journal.done_count('events')} events / {journal.done_count('market_done')} markets already committed")
+
+total_events = 0
+snapshot_market_ids = []
+for event in iter_events(snapshot_path):
+    total_events += 1
+    snapshot_market_ids.extend(str(market["id"]) for market in event.get("markets", []))
+total_markets = len(snapshot_market_ids)
+
+use_sink_watermarks = CONFIG["DELTA_FETCH"] and CONFIG["DELTA_SOURCE"] == "sink"
+WATERMARKS_UNAVAILABLE = REGISTRY.gauge(
+    "loader_watermarks_unavailable", "1 if price watermarks could not be loaded while DELTA_FETCH is on")
+if (CONFIG["WRITE_MODE"] == "skip" and CONFIG["PREFETCH_KEYS"]) or use_sink_watermarks:
+    try:
+        sink.prefetch_keys(known_keys, snapshot_market_ids, token_prices=CONFIG["ALL_OUTCOMES"])
+    except Exception as e:
+        # 主キーは価格ウォーターマークより先に読み込まれる。ウォーターマークが無い場合は
+        # ON CONFLICT DO NOTHINGのみで重複を防ぐが、差分取得が効かず全履歴を取得・送信する
+        logger.error(f"Error prefetching keys: {e}")
+        if use_sink_watermarks:
+            WATERMARKS_UNAVAILABLE.set(1)
+            print(f"WARNING: price watermarks are unavailable ({e}). DELTA_FETCH is on, but every open market "
+                  f"will be fetched and written in full. Create the price_watermarks RPC (see README).")
+snapshot_market_ids = None
+
+# 進捗と書き込みのメトリクス
+EVENTS_DONE = REGISTRY.counter("loader_events_total", "Events read from the snapshot")
+MARKETS_DONE = REGISTRY.counter("loader_markets_total", "Markets processed by outcome", ["outcome"])
+PRICES_FETCHED = REGISTRY.counter("loader_price_points_fetched_total", "Price points fetched from CLOB")
+ROWS_WRITTEN = REGISTRY.counter("db_rows_written_total", "Rows written to the database", ["table"])
+WRITE_LATENCY = REGISTRY.histogram("db_write_seconds", "Latency of a single write request", ["table"])
+WRITE_RETRIES = REGISTRY.counter("db_write_retries_total", "Retried write requests", ["table"])
+WRITE_TIMEOUTS = REGISTRY.counter("db_statement_timeouts_total", "Writes canceled by statement_timeout", ["table"])
+ROWS_FAILED = REGISTRY.counter("db_rows_failed_total", "Rows moved to the dead-letter store", ["table"])
+QUEUE_DEPTH = REGISTRY.gauge("pipeline_queue_depth", "Items waiting in front of a pipeline stage", ["stage"])
+
+last_counts = {"markets": 0, "prices": 0}
+
+def format_summary(elapsed):
+    """コンソールに出す1行サマリー。レートは前回の出力からの差分で計算する。"""
+    markets = MARKETS_DONE.value()
+    prices = ROWS_WRITTEN.value(table="prices")
+    market_rate = (markets - last_counts["markets"]) / elapsed if elapsed > 0 else 0
+    price_rate = (prices - last_counts["prices"]) / elapsed if elapsed > 0 else 0
+    last_counts.update(markets=markets, prices=prices)
+    fetch_p95 = PRICEHISTORY_LATENCY.quantile(0.95)
+    write_p95 = WRITE_LATENCY.quantile(0.95, table="prices")
+    return (f"events {EVENTS_DONE.value():.0f}/{total_events}"
+            f" | markets {markets:.0f}/{total_markets} ({market_rate:.1f}/s)"
+            f" | prices {prices:.0f}/{PRICES_FETCHED.value():.0f} ({price_rate:.0f}/s)"
+            f" | fetch {PRICEHISTORY_REQUESTS.value(outcome='ok'):.0f} ok {PRICEHISTORY_REQUESTS.value(outcome='error'):.0f} err"
+            f" p95 {fetch_p95 or 0:.2f}s retry {PRICEHISTORY_RETRIES.value():.0f}"
+            f" | write p95 {write_p95 or 0:.2f}s retry {WRITE_RETRIES.value():.0f}"
+            f" | failed rows {ROWS_FAILED.value():.0f}")
+
+reporter = MetricsReporter(format_summary, interval=CONFIG["METRICS_INTERVAL"],
+                           registry=REGISTRY, textfile=CONFIG["METRICS_TEXTFILE"]).start()
+if CONFIG["METRICS_PORT"]:
+    REGISTRY.start_http_server(CONFIG["METRICS_PORT"])
+
+def send_batch(table_name, batch):
+    if table_name == "prices" and price_sink is not None:
+        price_sink.write(batch)
+    else:
+        sink.write(table_name, batch)
+
+# テーブルごとのバッチサイズを書き込みレイテンシとタイムアウトから調整する
+batch_sizer = AdaptiveBatchSizer(
+    initial_size=CONFIG["BATCH_SIZE"],
+    min_size=CONFIG["BATCH_SIZE_MIN"],
+    max_size=CONFIG["BATCH_SIZE_MAX"],
+    target_latency=CONFIG["WRITE_TARGET_LATENCY"]
+)
+
+def send_batch_with_retry(table_name, batch):
+    """1バッチを送信し、エラー時にリトライ。ステートメントタイムアウトは分割して再送するため即座に投げる。"""
     for attempt in range(CONFIG["RETRY_COUNT"]):
+        if attempt > 0:
+            WRITE_RETRIES.inc(table=table_name)
         try:
-            supabase.table(table_name).insert(record).execute()
+            with WRITE_LATENCY.time(table=table_name):
+                send_batch(table_name, batch)
             return
         except Exception as e:
-            logger.error(f"Error inserting into {table_name} (attempt {attempt+1}/{CONFIG['RETRY_COUNT']}): {e}")
+            if is_statement_timeout(e):
+                WRITE_TIMEOUTS.inc(table=table_name)
+                logger.error(f"Statement timeout inserting {len(batch)} rows into {table_name}, splitting batch")
+                raise
+            logger.error(f"Error inserting batch into {table_name} (attempt {attempt+1}/{CONFIG['RETRY_COUNT']}): {e}")
             time.sleep(CONFIG["RETRY_DELAY"])
-    raise Exception(f"Failed to insert into {table_name} after {CONFIG['RETRY_COUNT']} attempts")
-
-def safe_batch_insert(table_name, records, batch_size):
-    """バルクインサート用。BATCH単位で挿入し、各BATCHでエラー時にリトライ。"""
-    for i in range(0, len(records), batch_size):
-        batch = records[i:i+batch_size]
-        for attempt in range(CONFIG["RETRY_COUNT"]):
-            try:
-                supabase.table(table_name).insert(batch).execute()
-                break
-            except Exception as e:
-                logger.error(f"Error inserting batch into {table_name} (attempt {attempt+1}/{CONFIG['RETRY_COUNT']}): {e}")
-                time.sleep(CONFIG["RETRY_DELAY"])
-        else:
-            # 全てのattemptで失敗
-            raise Exception(f"Failed to insert batch into {table_name} after {CONFIG['RETRY_COUNT']} attempts")
-
-def get_number_or_none(data, key):
-    value = data.get(key)
-    return value if value is not None else None
+    # 全てのattemptで失敗
+    raise Exception(f"Failed to insert batch into {table_name} after {CONFIG['RETRY_COUNT']} attempts")
+
+def record_written(table_name, records):
+    """コミットされたバッチごとに呼ばれる。既知キー・ジャーナル・メトリクスに反映する。"""
+    known_keys.add(table_name, records)
+    journal.on_committed(table_name, records)
+    ROWS_WRITTEN.inc(len(records), table=table_name)
+
+def safe_batch_insert(table_name, records):
+    """バルクインサート用。現在のバッチサイズ単位で挿入し、各バッチでエラー時にリトライ。"""
+    # COPYはステートメントタイムアウトの心配がないためバッチ全体を1回で送る
+    if table_name == "prices" and price_sink is not None:
+        send_batch_with_retry(table_name, records)
+        record_written(table_name, records)
+        return
+    # 途中で失敗した場合、コミット済みのバッチは反映済みで、残りの行のみPartialWriteErrorで返る
+    batch_sizer.write(table_name, records, send_batch_with_retry, on_written=record_written)
+
+def write_batch(table_name, records):
+    """BatchWriterから呼ばれる。テーブル単位でまとめられた行を挿入する。"""
+    safe_batch_insert(table_name, records)
+
+def log_batch_error(table_name, records, e):
+    # コミット済みのバッチは再送しないよう、失敗した残りの行のみ保存する
+    if isinstance(e, PartialWriteError):
+        records, e = e.rows, e.error
+    logger.error(f"Error inserting {len(records)} rows into {table_name}: {e}")
+    dead_letters.add(table_name, records, e)
+    ROWS_FAILED.inc(len(records), table=table_name)
+
+writer = BatchWriter(
+    write_batch,
+    max_rows=CONFIG["WRITER_MAX_ROWS"],
+    max_bytes=CONFIG["WRITER_MAX_BYTES"],
+    max_delay=CONFIG["WRITER_MAX_DELAY"],
+    on_error=log_batch_error
+)
+
+def queue_rows(table_name, records):
+    """
+    コミット済み (ジャーナル) の行と、skipモードではDBに既にある行を除いてからBatchWriterに渡す。
+    価格は既にキューに入れた (market_id, timestamp) と同じ行も除く。
+    渡した行数を返す。
+    """
+    if table_name == "events":
+        records = [r for r in records if not journal.is_done("events", r["id"])]
+    elif table_name == "prices":
+        records = journal.filter_prices(records)
+    # 価格は不変のため、保存済みの時刻以前の行はどのモードでも送らない (前回までの実行との重複を防ぐ)
+    if CONFIG["WRITE_MODE"] == "skip" or table_name in PRICE_TABLES:
+        records = known_keys.filter_new(table_name, records)
+    if table_name in PRICE_TABLES:
+        records = price_merger.filter_new(table_name, records)
+    writer.add_many(table_name, records)
+    return len(records)
 
 def insert_event_and_tags(event):
-    # eventsテーブル挿入
+    # eventsテーブル挿入 (BatchWriterにまとめて書き込む)
     try:
-        safe_insert("events", {
-            "id": event["id"],
-            "ticker": event.get("ticker", None),
-            "slug": event.get("slug", None),
-            "title": event.get("title", None),
-            "description": event.get("description", None),
-            "resolution_source": event.get("resolutionSource", None),
-            "start_date": event.get("startDate", None),
-            "creation_date": event.get("creationDate", None),
-            "end_date": event.get("endDate", None),
-            "image": event.get("image", None),
-            "icon": event.get("icon", None),
-            "active": event.get("active", None),
-            "closed": event.get("closed", None),
-            "archived": event.get("archived", None),
-            "new": event.get("new", None),
-            "featured": event.get("featured", None),
-            "restricted": event.get("restricted", None),
-            "liquidity": event.get("liquidity", None),
-            "volume": event.get("volume", None),
-            "open_interest": event.get("openInterest", None),
-            "sort_by": event.get("sortBy", None),
-            "created_at": event.get("createdAt", None),
-            "updated_at": event.get("updatedAt", None),
-            "competitive": event.get("competitive", None),
-            "volume_24hr": event.get("volume24hr", None),
-            "enable_order_book": event.get("enableOrderBook", None),
-            "liquidity_clob": event.get("liquidityClob", None),
-            "_sync": event.get("_sync", None),
-            "neg_risk": event.get("negRisk", None),
-            "neg_risk_market_id": event.get("negRiskMarketID", None),
-            "comment_count": event.get("commentCount", None),
-            "cyom": event.get("cyom", None),
-            "show_all_outcomes": event.get("showAllOutcomes", None),
-            "show_market_images": event.get("showMarketImages", None),
-            "enable_neg_risk": event.get("enableNegRisk", None),
-            "automatically_active": event.get("automaticallyActive", None),
-            "gmp_chart_mode": event.get("gmpChartMode", None),
-            "neg_risk_augmented": event.get("negRiskAugmented", None)
-        })
+        queue_rows("events", [EVENTS.to_dict(event)])
     except Exception as e:
         logger.error(f"Error inserting event {event['id']}: {e}")
 
     # tagsテーブル挿入
     if "tags" in event and event["tags"]:
-        tag_records = []
-        for tag in event["tags"]:
-            tag_records.append({
-                "event_id": event["id"],
-                "id": tag.get("id", None),
-                "label": tag.get("label", None),
-                "slug": tag.get("slug", None),
-                "force_show": tag.get("forceShow", None),
-                "published_at": tag.get("publishedAt", None),
-                "updated_by": tag.get("updatedBy", None),
-                "created_at": tag.get("createdAt", None),
-                "updated_at": tag.get("updatedAt", None),
-                "_sync": tag.get("_sync", None),
-                "force_hide": tag.get("forceHide", None)
-            })
-        try:
-            safe_batch_insert("tags", tag_records, CONFIG["BATCH_SIZE"])
-        except Exception as e:
-            logger.error(f"Error inserting tags for event {event['id']}: {e}")
+        queue_rows("tags", TAGS.dicts(event["tags"], event["id"]))
 
-def insert_markets_and_prices(event, market):
-    # markets挿入
+def insert_market(event, market):
+    """
+    markets行をBatchWriterに渡す。
+    ジャーナルに記録するため、書き込みキューに入れた行数を返す。
+    """
     try:
-        safe_insert("markets", {
-            "id": market["id"],
-            "event_id": event["id"],
-            "question": market.get("question", None),
-            "condition_id": market.get("conditionId", None),
-            "slug": market.get("slug", None),
-            "resolution_source": market.get("resolutionSource", None),
-            "end_date": market.get("endDate", None),
-            "liquidity": get_number_or_none(market, "liquidity"),
-            "start_date": market.get("startDate", None),
-            "image": market.get("image", None),
-            "icon": market.get("icon", None),
-            "description": market.get("description", None),
-            "outcomes": json.loads(market.get("outcomes")) if isinstance(market.get("outcomes"), str) else market.get("outcomes", None),
-            "outcome_prices": json.loads(market.get("outcomePrices")) if isinstance(market.get("outcomePrices"), str) else market.get("outcomePrices", None),
-            "volume": get_number_or_none(market, "volume"),
-            "active": market.get("active", None),
-            "closed": market.get("closed", None),
-            "market_maker_address": market.get("marketMakerAddress", None),
-            "created_at": market.get("createdAt", None),
-            "updated_at": market.get("updatedAt", None),
-            "new": market.get("new", None),
-            "featured": market.get("featured", None),
-            "submitted_by": market.get("submitted_by", None),
-            "archived": market.get("archived", None),
-            "resolved_by": market.get("resolvedBy", None),
-            "restricted": market.get("restricted", None),
-            "group_item_title": market.get("groupItemTitle", None),
-            "group_item_threshold": market.get("groupItemThreshold", None),
-            "question_id": market.get("questionID", None),
-            "enable_order_book": market.get("enableOrderBook", None),
-            "order_price_min_tick_size": market.get("orderPriceMinTickSize", None),
-            "order_min_size": market.get("orderMinSize", None),
-            "volume_num": get_number_or_none(market, "volumeNum"),
-            "liquidity_num": get_number_or_none(market, "liquidityNum"),
-            "end_date_iso": market.get("endDateIso", None),
-            "start_date_iso": market.get("startDateIso", None),
-            "has_reviewed_dates": market.get("hasReviewedDates", None),
-            "volume_24hr": get_number_or_none(market, "volume24hr"),
-            "clob_token_ids": json.loads(market.get("clobTokenIds")) if isinstance(market.get("clobTokenIds"), str) else market.get("clobTokenIds", None),
-            "uma_bond": market.get("umaBond", None),
-            "uma_reward": market.get("umaReward", None),
-            "volume_24hr_clob": get_number_or_none(market, "volume24hrClob"),
-            "volume_clob": get_number_or_none(market, "volumeClob"),
-            "liquidity_clob": get_number_or_none(market, "liquidityClob"),
-            "accepting_orders": market.get("acceptingOrders", None),
-            "neg_risk": market.get("negRisk", None),
-            "neg_risk_market_id": market.get("negRiskMarketID", None),
-            "neg_risk_request_id": market.get("negRiskRequestID", None),
-            "_sync": market.get("_sync", None),
-            "ready": market.get("ready", None),
-            "funded": market.get("funded", None),
-            "accepting_orders_timestamp": market.get("acceptingOrdersTimestamp", None),
-            "cyom": market.get("cyom", None),
-            "competitive": market.get("competitive", None),
-            "pager_duty_notification_enabled": market.get("pagerDutyNotificationEnabled", None),
-            "approved": market.get("approved", None),
-            "clob_rewards": market.get("clobRewards", None),
-            "rewards_min_size": market.get("rewardsMinSize", None),
-            "rewards_max_spread": market.get("rewardsMaxSpread", None),
-            "spread": market.get("spread", None),
-            "one_day_price_change": market.get("oneDayPriceChange", None),
-            "last_trade_price": market.get("lastTradePrice", None),
-            "best_bid": market.get("bestBid", None),
-            "best_ask": market.get("bestAsk", None),
-            "automatically_active": market.get("automaticallyActive", None),
-            "clear_book_on_start": market.get("clearBookOnStart", None),
-            "series_color": market.get("seriesColor", None),
-            "show_gmp_series": market.get("showGmpSeries", None),
-            "show_gmp_outcome": market.get("showGmpOutcome", None),
-            "manual_activation": market.get("manualActivation", None),
-            "neg_risk_other": market.get("negRiskOther", None)
-        })
+        return queue_rows("markets", [MARKETS.to_dict(market, event["id"])])
     except Exception as e:
         logger.error(f"Error inserting market {market['id']} of event {event['id']}: {e}")
-
-    # prices挿入はfetch_pricehistoryを使用
-    try:
-        # 価格履歴取得
-        if "clobTokenIds" in market and market["clobTokenIds"]:
-            token_ids = json.loads(market["clobTokenIds"]) if isinstance(market["clobTokenIds"], str) else market["clobTokenIds"]
-            if token_ids and len(token_ids) > 0:
-                price_data = fetch_pricehistory(market, token_ids[0], logger)
+        return 0
+
+def last_price_timestamp(market_id):
+    """差分取得の起点となる、保存済みの最新価格時刻。未保存の場合はNone。"""
+    if not CONFIG["DELTA_FETCH"]:
+        return None
+    if CONFIG["DELTA_SOURCE"] == "price_store":
+        return price_store.last_timestamp(market_id) if price_store is not None else None
+    return known_keys.price_watermark(market_id)
+
+def last_token_timestamp(market_id, token_id, first):
+    """
+    トークンごとの差分取得の起点。最初のアウトカムはpricesにも書き込むため、
+    prices/token_pricesの両方に保存済みの時刻までしか進めない。
+    """
+    if not CONFIG["DELTA_FETCH"] or CONFIG["DELTA_SOURCE"] != "sink":
+        return last_price_timestamp(market_id) if first else None
+    token_ts = known_keys.token_watermark(market_id, token_id)
+    if not first:
+        return token_ts
+    price_ts = known_keys.price_watermark(market_id)
+    return None if token_ts is None or price_ts is None else min(token_ts, price_ts)
+
+def fetch_stage(item):
+    """取得ステージ: CLOBから価格履歴を取得する。"""
+    market = item["market"]
+    item["history"] = None
+    item["token_histories"] = {}
+    if "clobTokenIds" in market and market["clobTokenIds"]:
+        token_ids = parse_json(market["clobTokenIds"])
+        if token_ids and len(token_ids) > 0:
+            if CONFIG["ALL_OUTCOMES"]:
+                # 全トークンを同時に取得する (所要時間は最も遅いトークン分)。
+                # 1トークンでも失敗した場合は例外となり、マーケットは完了扱いにならない
+                results = fetch_market_token_histories(
+                    fetch_pricehistory, market, token_ids, logger,
+                    since_ts=lambda token_id: last_token_timestamp(market["id"], token_id, token_id == token_ids[0]))
+                item["token_histories"] = {token_id: price_data['history'] for token_id, price_data in results.items()
+                                           if price_data and 'history' in price_data}
+                item["history"] = item["token_histories"].get(token_ids[0])
+            else:
+                price_data = fetch_pricehistory(market, token_ids[0], logger,
+                                                since_ts=last_price_timestamp(market["id"]))
                 if price_data and 'history' in price_data:
-                    history = price_data['history']
-                    main_pbar_prices.reset(total=len(history))
-                    main_pbar_prices.set_description("Processing prices")
-
-                    price_records = []
-                    for h in history:
-                        price_records.append({
-                            "market_id": market["id"],
-                            "timestamp": h.get("t"),
-                            "price": h.get("p")
-                        })
-
-                    # バルクインサート（再試行付き）
-                    for i in range(0, len(price_records), CONFIG["BATCH_SIZE"]):
-                        batch = price_records[i:i+CONFIG["BATCH_SIZE"]]
-                        safe_batch_insert("prices", batch, CONFIG["BATCH_SIZE"])
-                        main_pbar_prices.update(len(batch))
-    except Exception as e:
-        logger.error(f"Error inserting prices for market {market['id']} of event {event['id']}: {e}")
-
-def process_market_for_thread(market, event_id, markets_total, pbar_thread, thread_id, start_idx, end_idx):
-    pbar_thread.set_description(
-        f"{GREEN}Thread-{thread_id}{RESET} [{start_idx}-{end_idx}] {BLUE}Event:{event_id}{RESET} Processing Market:{market['id']} ({markets_total} total):"
-    )
-    insert_markets_and_prices({"id": event_id}, market)
-    main_pbar_markets.update(1)
-    return (1, 0)
-
-def process_event_for_thread(event, thread_id, pbar_thread, start_idx, end_idx):
-    event_id = event["id"]
-    markets = event.get("markets", [])
-    pbar_thread.set_description(
-        f"{GREEN}Thread-{thread_id}{RESET} [{start_idx}-{end_idx}] {BLUE}Event:{event_id}{RESET} Processing..."
-    )
-
-    # events, tags挿入
+                    item["history"] = price_data['history']
+    return item
+
+def transform_stage(item):
+    """変換ステージ: 価格履歴をローカルストアに書き込み、prices行に変換する。"""
+    market = item["market"]
+    history = item.pop("history")
+    item["price_records"] = []
+    if history:
+        if price_store is not None:
+            price_store.append_new(market["id"], history)
+        PRICES_FETCHED.inc(len(history))
+
+        item["price_records"] = PRICES.dicts(history, market["id"])
+
+    item["token_price_records"] = []
+    for token_id, token_history in item.pop("token_histories").items():
+        item["token_price_records"].extend(TOKEN_PRICES.dicts(token_history, market["id"], {"token_id": token_id}))
+    return item
+
+def write_stage(item):
+    """書き込みステージ: prices行をBatchWriterに渡す (バッファが一杯になるとこのスレッドで書き込む)。"""
+    market = item["market"]
+    # 親のmarkets行が先に書き込まれるようBatchWriterが順序を保証する
+    queued = item["queued"] + queue_rows("prices", item["price_records"])
+    if item["token_price_records"]:
+        queued += queue_rows("token_prices", item["token_price_records"])
+    # キューに入れた行が全てコミットされた時点でPriceMergerから捨て、クローズ済みなら完了として記録する。
+    # オープン中のマーケットは価格が増え続けるため完了扱いにしない
+    # (取得に失敗した場合は例外でこのステージまで来ない)
+    journal.expect_market(market["id"], queued, done=market.get("closed") == True)
+    MARKETS_DONE.inc(outcome="done")
+
+def log_stage_error(stage_name, item, e):
+    logger.error(f"Error in {stage_name} stage for market {item['market']['id']} of event {item['event_id']}: {e}")
+    MARKETS_DONE.inc(outcome="failed")
+
+pipeline = Pipeline([
+    Stage("fetch", fetch_stage, workers=CONFIG["FETCH_WORKERS"], queue_size=CONFIG["QUEUE_SIZE"]),
+    Stage("transform", transform_stage, workers=CONFIG["TRANSFORM_WORKERS"], queue_size=CONFIG["QUEUE_SIZE"]),
+    Stage("write", write_stage, workers=CONFIG["WRITE_WORKERS"], queue_size=CONFIG["QUEUE_SIZE"]),
+], on_error=log_stage_error)
+for stage in pipeline.stages:
+    QUEUE_DEPTH.set_function(lambda name=stage.name: pipeline.stats()[name]["queued"], stage=stage.name)
+
+# スナップショットを先頭から流し込む。events/tags/markets行は取得前にここで渡すため、
+# pricesより先にBatchWriterに入り、親テーブルとして先に書き込まれる
+for event in iter_events(snapshot_path):
     insert_event_and_tags(event)
-    main_pbar_events.update(1)
-
-    market_count = 0
-    price_count = 0
-    if markets:
-        with ThreadPoolExecutor(max_workers=CONFIG["MAX_WORKERS_MARKETS"]) as ex:
-            futures = [ex.submit(process_market_for_thread, m, event_id, len(markets), pbar_thread, thread_id, start_idx, end_idx) for m in markets]
-            for f in as_completed(futures):
-                m_c, p_c = f.result()
-                market_count += m_c
-                # price_countはmarkets挿入内で挿入済み
-    else:
-        pbar_thread.set_description(
-            f"{GREEN}Thread-{thread_id}{RESET} [{start_idx}-{end_idx}] {BLUE}Event:{event_id}{RESET} (No markets):"
-        )
-
-    return (1, market_count, price_count)
-
-def process_event_chunk(events_chunk, chunk_idx, start_idx, end_idx, thread_id):
-    pbar_threads[thread_id].set_description(
-        f"{GREEN}Thread-{thread_id}{RESET} [{start_idx}-{end_idx}] Starting Chunk {chunk_idx+1}/{total_chunks}:"
-    )
-
-    event_count = 0
-    market_count = 0
-    price_count = 0
-    for e in events_chunk:
-        e_c, m_c, p_c = process_event_for_thread(e, thread_id, pbar_threads[thread_id], start_idx, end_idx)
-        event_count += e_c
-        market_count += m_c
-        price_count += p_c
-
-    pbar_threads[thread_id].set_description(
-        f"{GREEN}Thread-{thread_id}{RESET} [{start_idx}-{end_idx}] Chunk {chunk_idx+1}/{total_chunks} Done:"
-    )
-    return (event_count, market_count, price_count)
-
-def get_next_chunk():
-    global next_chunk
-    with thread_lock:
-        if next_chunk < total_chunks:
-            c = next_chunk
-            next_chunk += 1
-            return c
-        else:
-            return None
-
-def worker_main(thread_id):
-    while True:
-        c_i = get_next_chunk()
-        if c_i is None:
-            pbar_threads[thread_id].set_description(f"{GREEN}Thread-{thread_id}{RESET}: Idle (No more chunks)")
-            break
-        start_idx = c_i * CONFIG["EVENT_CHUNK_SIZE"]
-        end_idx = min(start_idx + CONFIG["EVENT_CHUNK_SIZE"], len(event_data)) - 1
-        events_chunk = event_data[start_idx:end_idx+1]
-        process_event_chunk(events_chunk, c_i, start_idx, end_idx, thread_id)
-    return
-
-with ThreadPoolExecutor(max_workers=CONFIG["MAX_WORKERS_EVENTS"]) as executor:
-    futures = [executor.submit(worker_main, i) for i in range(CONFIG["MAX_WORKERS_EVENTS"])]
-    for f in as_completed(futures):
-        f.result()
-
-main_pbar_events.close()
-main_pbar_markets.close()
-main_pbar_prices.close()
+    for market in event.get("markets", []):
+        # 前回の実行で完了済みのマーケットは価格履歴の取得ごとスキップ
+        if journal.is_done("market_done", market["id"]):
+            MARKETS_DONE.inc(outcome="skipped")
+            continue
+        queued = insert_market(event, market)
+        # 取得ステージのキューが一杯の間はここで待つ
+        pipeline.put({"event_id": event["id"], "market": market, "queued": queued})
+    EVENTS_DONE.inc()
+
+# キューに残った項目を全て処理してからワーカーを止める
+pipeline.close()
+
+# バッファに残った行を書き込む
+writer.close()
+
+# 最終サマリーを出力し、メトリクスファイルを更新する
+reporter.stop()
+
+# 失敗が無ければジャーナルを消去し、次回の実行は最初から (オープン中のマーケットも差分取得して) 行う
+# 以前の実行で残ったdead letterは数えない (replay_dead_letters.pyで再送する)
+if MARKETS_DONE.value(outcome="failed") == 0 and dead_letters.added == 0:
+    journal.finish_run()
+journal.close()
+
+if len(dead_letters) > 0:
+    for table, (batches, rows) in dead_letters.counts().items():
+        print(f"Dead letters: {table} {batches} batches / {rows} rows (replay: python supabase/replay_dead_letters.py)")
+dead_letters.close()
+
+print(f"Final batch sizes: {batch_sizer.sizes()}")
+
+sink.close()
+
+if price_sink is not None:
+    print(f"COPY sink: {price_sink.rows_inserted} of {price_sink.rows_copied} copied prices were new")
+    price_sink.close()
+
+if PRICEHISTORY_FETCHER.cache is not None:
+    stats = PRICEHISTORY_FETCHER.cache.stats()
+    print(f"Price history cache: {stats['hits']} hits / {stats['misses']} misses ({stats['hit_rate']:.1%})")
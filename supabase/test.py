@@ -17,6 +17,7 @@ project_root = os.path.dirname(current_dir)
 sys.path.append(project_root)
 
 from gamma.lib.fetch_single_pricehistory import fetch_all_pricehistory
+from gamma.lib.snapshot import load_event_range
 
 # .env読込
 load_dotenv()
@@ -26,12 +27,13 @@ url: str = os.environ.get("SUPABASE_URL")
 key: str = os.environ.get("SUPABASE_KEY")
 supabase: Client = create_client(url, key) if url and key else None
 
-def compare_with_supabase(local_event_data, input_event_index, supabase_client: Client):
+def compare_with_supabase(local_event_data, input_event_index, supabase_client: Client, start_index=0):
     """
     指定したイベントインデックスのローカルデータとSupabase上のデータを比較表示する関数。
+    local_event_data は start_index から始まるイベントのリスト。
     """
     try:
-        event = local_event_data[input_event_index]
+        event = local_event_data[input_event_index - start_index]
         print(colored(f"\n--- Test Contents [{input_event_index}] ---", 'white', attrs=['bold']))
         print(colored("Test\t\t\tSupabase\tLocalDB\t\tResult", 'white'))
         # イベントIDでSupabaseのeventsテーブルと比較
@@ -79,9 +81,8 @@ def display_event_structure(start_index, end_index, check_supabase=False):
     指定範囲のイベント情報を表示するメイン関数。
     check_supabase=Trueの場合はSupabaseと比較表示を行う。
     """
-    # events.json 読込 (相対パスは環境に応じて調整)
-    with open("../gamma/output/events.json", "r") as f:
-        local_event_data = json.load(f)
+    # スナップショットから指定範囲のみ読込
+    local_event_data = load_event_range(start_index, end_index)
     total_markets = 0
     total_price_history = 0
     event_indices = range(start_index, end_index + 1)
@@ -89,7 +90,7 @@ def display_event_structure(start_index, end_index, check_supabase=False):
     previous_event_id = None
     for input_event_index in event_indices:
         try:
-            event = local_event_data[input_event_index]
+            event = local_event_data[input_event_index - start_index]
             current_event_id = event['id']
             display_event_id = current_event_id if current_event_id != previous_event_id else ''
 
@@ -128,7 +129,7 @@ def display_event_structure(start_index, end_index, check_supabase=False):
 
             # Supabaseチェックオプションが有効な場合
             if check_supabase and supabase:
-                compare_with_supabase(local_event_data, input_event_index, supabase)
+                compare_with_supabase(local_event_data, input_event_index, supabase, start_index)
             elif check_supabase and not supabase:
                 print(colored("Warning: Supabase client not configured. Skipping comparison.", 'yellow'))
 
@@ -142,7 +143,7 @@ def display_event_structure(start_index, end_index, check_supabase=False):
         supabase_table_data = []
         for input_event_index in event_indices:
             try:
-                event = local_event_data[input_event_index]
+                event = local_event_data[input_event_index - start_index]
                 for market in event['markets']:
                     local_price_history = fetch_all_pricehistory(market)
                     supabase_price_db = supabase.table('prices').select('*').eq('market_id', market['id']).execute()
@@ -13,15 +13,17 @@ project_root = os.path.dirname(current_dir)
 sys.path.append(project_root)
 
 from gamma.lib.fetch_single_pricehistory import fetch_all_pricehistory
+from gamma.lib.snapshot import load_event_range
 
 url: str = os.environ.get("SUPABASE_URL")
 key: str = os.environ.get("SUPABASE_KEY")
 supabase: Client = create_client(url, key)
 
 
-def compare_with_supabase(event_data, event_index, supabase):
+def compare_with_supabase(event_data, event_index, supabase, start_index=0):
+    # event_data は start_index から始まるイベントのリスト
     try:
-        event = event_data[event_index]
+        event = event_data[event_index - start_index]
         
         print(colored(f"\n--- Test Contents [{event_index}] ---", 'white', attrs=['bold']))
         print(colored("Test内容\tSupabase\tLocalDB\t結果", 'white'))
@@ -57,8 +59,8 @@ def compare_with_supabase(event_data, event_index, supabase):
         print(colored(f"Error: Missing required field in event data - {e}", 'red'))
 
 def display_event_structure(start_index, end_index, check_supabase=False):
-    with open("../gamma/output/events.json", "r") as f:
-        event_data = json.load(f)
+    # スナップショットのインデックスから指定範囲のみデコードする
+    event_data = load_event_range(start_index, end_index)
     
     total_markets = 0
     total_price_history = 0
@@ -71,7 +73,7 @@ def display_event_structure(start_index, end_index, check_supabase=False):
     # tqdmで進捗バーを表示
     for event_index in range(start_index, end_index + 1):
         try:
-            event = event_data[event_index]
+            event = event_data[event_index - start_index]
             current_event_id = event['id']
             
             # 前のイベントIDと同じ場合は空白を表示
@@ -104,7 +106,7 @@ def display_event_structure(start_index, end_index, check_supabase=False):
             previous_event_id = current_event_id
             
             if check_supabase:
-                results = compare_with_supabase(event_data, event_index, supabase)
+                results = compare_with_supabase(event_data, event_index, supabase, start_index)
 
                 
         except KeyError as e:
@@ -117,7 +119,7 @@ def display_event_structure(start_index, end_index, check_supabase=False):
         supabase_table_data = []
         for event_index in range(start_index, end_index + 1):
             try:
-                event = event_data[event_index]
+                event = event_data[event_index - start_index]
                 
                 for market in event['markets']:
                     price_history = fetch_all_pricehistory(market)